@@ -1,10 +1,12 @@
 import streamlit as st
-from PIL import Image
 import pandas as pd
 from database import ReceiptDatabase
 from ocr_processor import ReceiptOCR
-from receipt_parser import ReceiptParser
+from receipt_parser import PARSER_VERSION, ReceiptParser
+from instrumentation import metrics
+from processing_queue import ProcessingQueue
 import os
+import uuid
 
 # Page configuration
 st.set_page_config(
@@ -13,117 +15,129 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize components
+# OCR engine is shared across reruns and sessions so its cache of
+# preprocessed images and OCR text survives widget interactions
+@st.cache_resource
+def get_ocr():
+    return ReceiptOCR(cache_dir=os.environ.get('RECEIPT_OCR_CACHE_DIR'))
+
+# Initialize components once per server process: reruns and page switches
+# reuse the same database connections and query cache
+@st.cache_resource
 def init_components():
     db = ReceiptDatabase()
-    ocr = ReceiptOCR()
+    ocr = get_ocr()
     parser = ReceiptParser()
     return db, ocr, parser
 
 db, ocr, parser = init_components()
 
+# Background OCR queue, shared by all sessions
+@st.cache_resource
+def get_processing_queue():
+    return ProcessingQueue()
+
 # Initialize session state
-if 'ocr_text' not in st.session_state:
-    st.session_state.ocr_text = None
-if 'parsed_data' not in st.session_state:
-    st.session_state.parsed_data = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'submitted_files' not in st.session_state:
+    st.session_state.submitted_files = set()
+# Uploaded bytes by job ID, kept for the review form (the queue doesn't keep them)
+if 'uploads' not in st.session_state:
+    st.session_state.uploads = {}
 
 # Title and description
 st.title("🧾 Receipt Tracker")
 st.markdown("Upload receipt images to track your spending")
 
 # Sidebar for navigation
-page = st.sidebar.selectbox("Navigation", ["Upload Receipt", "View Receipts", "Spending Summary"])
+page = st.sidebar.selectbox("Navigation", ["Upload Receipt", "View Receipts", "Spending Summary",
+                                          "Spending Trends"])
 
 # Page: Upload Receipt
 if page == "Upload Receipt":
-    st.header("Upload a Receipt")
+    st.header("Upload Receipts")
+    
+    processing_queue = get_processing_queue()
+    session_id = st.session_state.session_id
     
     # File uploader
-    uploaded_file = st.file_uploader("Choose a receipt image", type=['jpg', 'jpeg', 'png'])
+    uploaded_files = st.file_uploader("Choose receipt images", type=['jpg', 'jpeg', 'png'],
+                                      accept_multiple_files=True)
     
-    if uploaded_file is not None:
-        # Display the uploaded image
-        image = Image.open(uploaded_file)
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("Original Image")
-            st.image(image, width='stretch')
+    # Queue files we haven't seen yet (the uploader keeps its files across reruns)
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.file_id not in st.session_state.submitted_files:
+            data = uploaded_file.getvalue()
+            job_id = processing_queue.submit(uploaded_file.name, data, owner=session_id)
+            st.session_state.uploads[job_id] = data
+            st.session_state.submitted_files.add(uploaded_file.file_id)
+    
+    def forget_job(job_id):
+        processing_queue.remove(job_id)
+        st.session_state.uploads.pop(job_id, None)
+    
+    def review_job(job):
+        """Editable form for one finished receipt"""
+        parsed_data = job['result']['parsed']
+        is_valid, missing_fields = parser.validate_parsed_data(parsed_data)
+        label = f"✅ {job['name']}" if is_valid else f"⚠️ {job['name']} (missing: {', '.join(missing_fields)})"
         
-        with col2:
-            st.subheader("Preprocessed Image")
-            processed_img = ocr.get_processed_image(image)
-            st.image(processed_img, width='stretch')
-        
-        # Process button
-        if st.button("Extract Data", type="primary"):
-            with st.spinner("Processing receipt..."):
-                # Perform OCR
-                ocr_text = ocr.extract_text(image)
-                st.session_state.ocr_text = ocr_text  # Save to session state
-                
-                # Show raw OCR text in expander
-                with st.expander("View Raw OCR Text"):
-                    st.text(ocr_text)
-                
-                # Parse the receipt
-                parsed_data = parser.parse_walmart_receipt(ocr_text)
-                st.session_state.parsed_data = parsed_data  # Save to session state
-                
-                # Validate
-                is_valid, missing_fields = parser.validate_parsed_data(parsed_data)
-                
-                if is_valid:
-                    st.success("✅ Receipt data extracted successfully!")
-                else:
-                    st.warning(f"⚠️ Some fields are missing: {', '.join(missing_fields)}")
-        
-        # Display form if we have parsed data
-        if st.session_state.parsed_data is not None:
-            parsed_data = st.session_state.parsed_data
-            
-            # Display extracted data
-            st.subheader("Extracted Data")
+        with st.expander(label, expanded=True):
+            col1, col2 = st.columns(2)
+            with col1:
+                data = st.session_state.uploads.get(job['id'])
+                if data is not None:
+                    st.image(data, width='stretch')
+                    if st.toggle("Show preprocessed image", key=f"preprocessed_{job['id']}"):
+                        st.image(ocr.get_processed_image(ocr.load_image(data)), width='stretch')
+                if st.toggle("Show raw OCR text", key=f"raw_{job['id']}"):
+                    st.text(job['result']['ocr_text'])
+                if parsed_data.get('items'):
+                    st.caption(f"{len(parsed_data['items'])} line item(s)")
+                    st.dataframe(pd.DataFrame(parsed_data['items']), hide_index=True, width='stretch')
             
-            # Create editable form
-            with st.form("receipt_form"):
-                store_name = st.text_input("Store Name", value=parsed_data.get('store_name', ''))
-                date = st.text_input("Date", value=parsed_data.get('date', ''))
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
+            with col2:
+                # Create editable form
+                with st.form(f"receipt_form_{job['id']}"):
+                    store_name = st.text_input("Store Name", value=parsed_data.get('store_name') or '')
+                    date = st.text_input("Date", value=parsed_data.get('date') or '')
+                    
                     subtotal = st.number_input("Subtotal ($)", 
-                                              value=float(parsed_data.get('subtotal') or 0), 
-                                              format="%.2f")
-                with col2:
+                                               value=float(parsed_data.get('subtotal') or 0), 
+                                               format="%.2f")
                     tax = st.number_input("Tax ($)", 
-                                        value=float(parsed_data.get('tax') or 0), 
-                                        format="%.2f")
-                with col3:
-                    total = st.number_input("Total ($)", 
-                                          value=float(parsed_data.get('total') or 0), 
+                                          value=float(parsed_data.get('tax') or 0), 
                                           format="%.2f")
+                    total = st.number_input("Total ($)", 
+                                            value=float(parsed_data.get('total') or 0), 
+                                            format="%.2f")
+                    
+                    transaction_id = st.text_input("Transaction ID", 
+                                                   value=parsed_data.get('transaction_id') or '')
+                    
+                    col_save, col_discard = st.columns(2)
+                    with col_save:
+                        submitted = st.form_submit_button("Save to Database", type="primary")
+                    with col_discard:
+                        discarded = st.form_submit_button("Discard")
                 
-                transaction_id = st.text_input("Transaction ID", 
-                                              value=parsed_data.get('transaction_id', ''))
-                
-                # Submit button
-                submitted = st.form_submit_button("Save to Database", type="primary")
+                if discarded:
+                    forget_job(job['id'])
+                    st.rerun()
                 
                 if submitted:
-                    st.write("**[DEBUG] Form submitted!**")
-                    st.write(f"Store: {store_name}")
-                    st.write(f"Date: {date}")
-                    st.write(f"Subtotal: {subtotal}")
-                    st.write(f"Tax: {tax}")
-                    st.write(f"Total: {total}")
-                    st.write(f"Transaction ID: {transaction_id}")
-                    
                     if store_name and date and total > 0:
+                        # Fields changed in the form stay as typed when the receipt is re-parsed
+                        values = {'store_name': store_name, 'date': date, 'subtotal': subtotal,
+                                  'tax': tax, 'total': total, 'transaction_id': transaction_id}
+                        edited_fields = [
+                            field for field, value in values.items()
+                            if (round(value, 2) != round(float(parsed_data.get(field) or 0), 2)
+                                if isinstance(value, float)
+                                else value != (parsed_data.get(field) or ''))
+                        ]
                         try:
-                            st.write("**[DEBUG] Validation passed, calling database...**")
                             # Save to database
                             receipt_id = db.add_receipt(
                                 store_name=store_name,
@@ -132,31 +146,68 @@ if page == "Upload Receipt":
                                 tax=tax,
                                 total=total,
                                 transaction_id=transaction_id,
-                                image_path=uploaded_file.name,
-                                raw_ocr_text=st.session_state.ocr_text
+                                image_path=job['name'],
+                                raw_ocr_text=job['result']['ocr_text'],
+                                items=parsed_data.get('items'),
+                                parser_version=PARSER_VERSION,
+                                edited_fields=edited_fields,
+                                ocr_partial=job['result']['ocr_partial']
                             )
-                            st.success(f"✅ Receipt saved successfully! (ID: {receipt_id})")
-                            st.balloons()
-                            
-                            # Verify immediately
-                            st.write("**[DEBUG] Verifying save...**")
-                            all_receipts = db.get_all_receipts()
-                            st.write(f"Total receipts in database now: {len(all_receipts)}")
-                            
-                            # Clear session state
-                            st.session_state.ocr_text = None
-                            st.session_state.parsed_data = None
-                            
-                            # Add a note to check other pages
-                            st.info("✅ Receipt saved! Navigate to 'View Receipts' or 'Spending Summary' to see your data!")
-                            
                         except Exception as e:
                             st.error(f"❌ Error saving to database: {str(e)}")
-                            import traceback
-                            st.code(traceback.format_exc())
+                        else:
+                            forget_job(job['id'])
+                            st.toast(f"✅ {job['name']} saved (ID: {receipt_id})")
+                            st.rerun()
                     else:
                         st.error("❌ Please fill in required fields: Store Name, Date, and Total")
-                        st.write(f"Validation failed: store_name={bool(store_name)}, date={bool(date)}, total>0={total > 0}")
+    
+    # Poll for progress only while something is still running
+    polling = processing_queue.pending(session_id) > 0
+    
+    @st.fragment(run_every=1.0 if polling else None)
+    def show_jobs():
+        jobs = processing_queue.jobs(session_id)
+        # Let go of uploads whose jobs the queue has expired
+        job_ids = {job['id'] for job in jobs}
+        for job_id in list(st.session_state.uploads):
+            if job_id not in job_ids:
+                del st.session_state.uploads[job_id]
+        if not jobs:
+            st.info("Upload one or more receipt images. They are processed in the background "
+                    "and appear here for review as they finish.")
+            return
+        
+        pending = [job for job in jobs if job['status'] in ('queued', 'processing')]
+        if polling and not pending:
+            # Everything finished: rerun the page once to stop polling
+            st.rerun()
+        
+        # Live status for every file in this session
+        status_icons = {'queued': '🕒 queued', 'processing': '⚙️ processing',
+                        'done': '✅ ready for review', 'failed': '❌ failed'}
+        st.dataframe(pd.DataFrame([
+            {'File': job['name'], 'Status': status_icons[job['status']],
+             'OCR Tier': (job['result'] or {}).get('ocr_tier'),
+             'Confidence': (job['result'] or {}).get('ocr_confidence'),
+             'Seconds': round(job['elapsed'], 1)}
+            for job in jobs
+        ]), hide_index=True, width='stretch')
+        if pending:
+            st.caption(f"{len(pending)} receipt(s) still processing on "
+                       f"{processing_queue.workers} worker(s)...")
+        
+        for job in jobs:
+            if job['status'] == 'done':
+                review_job(job)
+            elif job['status'] == 'failed':
+                with st.expander(f"❌ {job['name']}", expanded=True):
+                    st.error(job['error'])
+                    if st.button("Dismiss", key=f"dismiss_{job['id']}"):
+                        forget_job(job['id'])
+                        st.rerun()
+    
+    show_jobs()
 
 # Page: View Receipts
 elif page == "View Receipts":
@@ -167,25 +218,99 @@ elif page == "View Receipts":
         st.write(f"Database file: {db.db_name}")
         st.write(f"Database exists: {os.path.exists(db.db_name)}")
     
-    receipts_df = db.get_all_receipts()
+    summary_df = db.get_spending_summary()
+    total_receipts = int(summary_df['num_receipts'].sum())
     
-    if len(receipts_df) > 0:
-        # Display summary metrics
+    if total_receipts > 0:
+        # Display summary metrics (from the precomputed summary table)
+        total_spent = summary_df['total_spent'].sum()
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Receipts", len(receipts_df))
+            st.metric("Total Receipts", total_receipts)
         with col2:
-            st.metric("Total Spent", f"${receipts_df['total'].sum():.2f}")
+            st.metric("Total Spent", f"${total_spent:.2f}")
         with col3:
-            st.metric("Total Tax", f"${receipts_df['tax'].sum():.2f}")
+            st.metric("Total Tax", f"${summary_df['total_tax'].sum():.2f}")
         with col4:
-            st.metric("Avg Per Receipt", f"${receipts_df['total'].mean():.2f}")
+            st.metric("Avg Per Receipt", f"${total_spent / total_receipts:.2f}")
         
         st.divider()
         
-        # Display table
-        display_df = receipts_df[['id', 'store_name', 'date', 'subtotal', 'tax', 'total', 'transaction_id', 'created_at']]
-        st.dataframe(display_df, width='stretch')
+        search_text = st.text_input("Search receipt text",
+                                    placeholder='e.g. great value milk, "TIDE PODS", banan*')
+        
+        # Filters and paging controls
+        sort_options = {"Date": 'date', "Total": 'total', "Date Added": 'created_at', "ID": 'id'}
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            stores = ["All stores"] + sorted(summary_df['store_name'].dropna().tolist())
+            store_choice = st.selectbox("Store", stores)
+        with col2:
+            sort_label = st.selectbox("Sort by", list(sort_options))
+        with col3:
+            descending = st.selectbox("Order", ["Newest / largest first", "Oldest / smallest first"]) == "Newest / largest first"
+        with col4:
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        
+        date_range = st.date_input("Date range (optional)", value=())
+        date_from, date_to = date_range if len(date_range) == 2 else (None, None)
+        store_filter = None if store_choice == "All stores" else store_choice
+        
+        if search_text.strip():
+            # Full-text search, best matches first
+            results_df = db.search_receipts(search_text, limit=page_size, store_name=store_filter,
+                                            date_from=date_from, date_to=date_to)
+            st.dataframe(results_df, width='stretch')
+            st.caption(f"{len(results_df)} best match(es) for \"{search_text}\"")
+        else:
+            # Start again from the first page whenever the filters change
+            filters = (store_filter, sort_options[sort_label], descending, page_size, date_from, date_to)
+            if st.session_state.get('receipt_filters') != filters:
+                st.session_state.receipt_filters = filters
+                st.session_state.receipt_cursors = [None]
+            cursors = st.session_state.receipt_cursors
+            
+            page_df, next_cursor = db.get_receipts_page(
+                page_size=page_size,
+                cursor=cursors[-1],
+                sort_by=sort_options[sort_label],
+                descending=descending,
+                store_name=store_filter,
+                date_from=date_from,
+                date_to=date_to
+            )
+            matching = db.count_receipts(store_filter, date_from, date_to)
+            
+            # Display table
+            st.dataframe(page_df, width='stretch')
+            
+            col1, col2, col3 = st.columns([1, 1, 4])
+            with col1:
+                if st.button("← Previous", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                if st.button("Next →", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
+            with col3:
+                num_pages = max(1, -(-matching // page_size))
+                st.caption(f"Page {len(cursors)} of {num_pages} · {matching} matching receipt(s)")
+        
+        # Receipt details (line items and OCR text are loaded on demand)
+        st.subheader("Receipt Details")
+        receipt_id_to_view = st.number_input("Enter Receipt ID to view", min_value=1, step=1)
+        items_df = db.get_receipt_items(receipt_id_to_view)
+        if len(items_df) > 0:
+            st.dataframe(items_df, hide_index=True, width='stretch')
+        else:
+            st.caption("No line items saved for this receipt.")
+        if st.toggle("Show raw OCR text"):
+            raw_text = db.get_raw_ocr_text(receipt_id_to_view)
+            if raw_text:
+                st.text(raw_text)
+            else:
+                st.caption("No OCR text saved for this receipt.")
         
         # Option to delete receipts
         st.subheader("Delete Receipt")
@@ -201,13 +326,12 @@ elif page == "View Receipts":
 elif page == "Spending Summary":
     st.header("Spending Summary by Store")
     
+    summary_df = db.get_spending_summary()
+    
     # Debug: Show database path
     with st.expander("🔍 Debug Info"):
         st.write(f"Database file: {db.db_name}")
-        all_receipts = db.get_all_receipts()
-        st.write(f"Total receipts in database: {len(all_receipts)}")
-    
-    summary_df = db.get_spending_summary()
+        st.write(f"Total receipts in database: {int(summary_df['num_receipts'].sum())}")
     
     if len(summary_df) > 0:
         # Display summary table
@@ -220,9 +344,101 @@ elif page == "Spending Summary":
         st.subheader("Number of Receipts by Store")
         st.bar_chart(summary_df.set_index('store_name')['num_receipts'])
         
+        monthly_df = db.get_monthly_summary()
+        if len(monthly_df) > 0:
+            st.subheader("Total Spending by Month")
+            st.bar_chart(monthly_df.set_index('month')['total_spent'])
+        
+        products_df = db.get_product_spending(limit=20)
+        if len(products_df) > 0:
+            st.subheader("Top Products by Spending")
+            st.dataframe(products_df, hide_index=True, width='stretch')
+        
     else:
         st.info("No spending data available yet. Upload some receipts!")
 
+# Page: Spending Trends
+elif page == "Spending Trends":
+    st.header("Spending Trends")
+    
+    summary_df = db.get_spending_summary()
+    
+    # Controls
+    periods = {"Day": 'day', "Week": 'week', "Month": 'month'}
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        period_label = st.selectbox("Group by", list(periods), index=1)
+    with col2:
+        stores = ["All stores"] + sorted(summary_df['store_name'].dropna().tolist())
+        store_choice = st.selectbox("Store", stores)
+    with col3:
+        rolling = st.number_input("Rolling average (periods)", min_value=1, max_value=52, value=4)
+    
+    date_range = st.date_input("Date range (optional)", value=())
+    date_from, date_to = date_range if len(date_range) == 2 else (None, None)
+    store_filter = None if store_choice == "All stores" else store_choice
+    
+    trends_df = db.get_spending_timeseries(
+        periods[period_label],
+        store_name=store_filter,
+        date_from=date_from,
+        date_to=date_to,
+        rolling=rolling
+    )
+    
+    if len(trends_df) > 0:
+        # Display summary metrics for the selected range
+        num_receipts = int(trends_df['num_receipts'].sum())
+        total_spent = trends_df['total_spent'].sum()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Receipts", num_receipts)
+        with col2:
+            st.metric("Total Spent", f"${total_spent:.2f}")
+        with col3:
+            st.metric("Total Tax", f"${trends_df['total_tax'].sum():.2f}")
+        with col4:
+            st.metric(f"Avg Per {period_label}", f"${total_spent / len(trends_df):.2f}")
+        
+        st.subheader("Spending")
+        st.line_chart(trends_df[['total_spent', 'rolling_avg_spent']])
+        
+        st.subheader("Tax")
+        st.bar_chart(trends_df['total_tax'])
+        
+        st.subheader("Average Per Receipt")
+        st.line_chart(trends_df['avg_per_receipt'])
+        
+        with st.expander("Data"):
+            st.dataframe(trends_df, width='stretch')
+    else:
+        st.info("No dated receipts in this range yet.")
+
+# Performance panel
+st.sidebar.markdown("---")
+with st.sidebar.expander("⏱️ Performance"):
+    metrics_on = st.toggle("Record timings", value=metrics.enabled)
+    if metrics_on:
+        metrics.enable()
+    else:
+        metrics.disable()
+    
+    snapshot = metrics.snapshot()
+    if snapshot:
+        timings_df = pd.DataFrame([
+            {'span': name, 'count': stats['count'], 'mean ms': stats['mean_ms'],
+             'p95 ms': stats['p95_ms'], 'max ms': stats['max_ms']}
+            for name, stats in snapshot.items()
+        ])
+        st.dataframe(timings_df.round(2), hide_index=True, width='stretch')
+        st.download_button("Download JSON", metrics.to_json(), "timings.json", "application/json")
+        st.download_button("Download Prometheus", metrics.to_prometheus(), "timings.prom", "text/plain")
+        if st.button("Reset timings"):
+            metrics.reset()
+            st.rerun()
+    elif metrics.enabled:
+        st.caption("No timings recorded yet.")
+
 # Footer
 st.sidebar.markdown("---")
 st.sidebar.markdown("### About")
@@ -0,0 +1,213 @@
+"""
+Headless batch ingestion of receipt images
+
+Walks folders (or reads a file list), runs OCR + parsing across a process
+pool and saves the results to the receipts database in batches.
+
+Usage:
+    python batch_ingest.py scans/ more_scans/ --workers 8
+    python batch_ingest.py --file-list todo.txt --db receipts.db
+    python batch_ingest.py scans/ --layout totals
+
+Finished files are appended to a checkpoint file after every database
+flush, so re-running the same command after a crash only picks up the
+files that were not saved yet.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database import ReceiptDatabase
+from ocr_processor import LAYOUTS
+from processing_queue import init_worker, process_image, tile_workers_for
+from receipt_parser import PARSER_VERSION
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def collect_image_paths(sources, file_list=None):
+    """Expand directories and file lists into a sorted list of image paths"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, name))
+        else:
+            paths.append(source)
+
+    if file_list:
+        with open(file_list) as f:
+            paths.extend(line.strip() for line in f if line.strip())
+
+    # Normalize and de-duplicate so the checkpoint matches across runs
+    return sorted({os.path.abspath(p) for p in paths})
+
+
+def load_checkpoint(checkpoint_path):
+    """Return the set of image paths already saved by a previous run"""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+class BatchIngester:
+    def __init__(self, db, workers=None, batch_size=100, checkpoint_path=None,
+                 allow_incomplete=False, layout=None):
+        self.db = db
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.allow_incomplete = allow_incomplete
+        self.layout = layout
+
+        self.failures = []
+        self.saved = 0
+        # OCR cascade tier -> number of images it produced the text for
+        self.tiers = {}
+        self._pending = []
+
+    def run(self, paths):
+        """
+        Process all paths and save the results
+        Returns: dict with run statistics
+        """
+        done = load_checkpoint(self.checkpoint_path)
+        todo = [p for p in paths if p not in done]
+        skipped = len(paths) - len(todo)
+
+        if skipped:
+            print(f"Skipping {skipped} file(s) already saved by a previous run")
+        print(f"Processing {len(todo)} file(s) with {self.workers} worker(s)...")
+
+        start = time.perf_counter()
+        processed = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                 initargs=(False, self.layout, tile_workers_for(self.workers))) as pool:
+            futures = [pool.submit(process_image, path) for path in todo]
+            for future in as_completed(futures):
+                self._handle_result(future.result())
+                processed += 1
+                if processed % 50 == 0:
+                    print(f"  {processed}/{len(todo)} processed")
+
+        self._flush()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'total': len(paths),
+            'skipped': skipped,
+            'processed': processed,
+            'saved': self.saved,
+            'failed': len(self.failures),
+            'elapsed': elapsed,
+            'images_per_sec': processed / elapsed if elapsed > 0 else 0.0,
+            'tiers': dict(self.tiers),
+        }
+
+    def _handle_result(self, result):
+        """Queue a successful result for saving or record the failure"""
+        path = result['name']
+
+        if result['error']:
+            self._fail(path, result['error'])
+            return
+        self.tiers[result['ocr_tier']] = self.tiers.get(result['ocr_tier'], 0) + 1
+
+        parsed = result['parsed']
+        if not self.allow_incomplete:
+            missing = [field for field in ('store_name', 'date', 'total') if not parsed.get(field)]
+            if missing:
+                self._fail(path, f"missing fields: {', '.join(missing)}")
+                return
+
+        self._pending.append(result)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _fail(self, path, reason):
+        self.failures.append((path, reason))
+        print(f"[FAIL] {path}: {reason}", file=sys.stderr)
+
+    def _flush(self):
+        """Save pending results and record them in the checkpoint"""
+        if not self._pending:
+            return
+
+        self.db.add_receipts(
+            dict(result['parsed'], image_path=result['name'], raw_ocr_text=result['ocr_text'],
+                 parser_version=PARSER_VERSION, ocr_partial=result['ocr_partial'])
+            for result in self._pending
+        )
+
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, 'a') as f:
+                f.writelines(result['name'] + '\n' for result in self._pending)
+
+        self.saved += len(self._pending)
+        self._pending = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch OCR receipt images into the database")
+    parser.add_argument('sources', nargs='*', help="Image files or directories to scan")
+    parser.add_argument('--file-list', help="Text file with one image path per line")
+    parser.add_argument('--db', default='receipts.db', help="Database file (default: receipts.db)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="Receipts saved per database flush (default: 100)")
+    parser.add_argument('--checkpoint', default='ingest_checkpoint.txt',
+                        help="File recording saved images, used to resume (default: ingest_checkpoint.txt)")
+    parser.add_argument('--allow-incomplete', action='store_true',
+                        help="Save receipts even when store name, date or total is missing")
+    parser.add_argument('--layout', choices=LAYOUTS, default=None,
+                        help="OCR layout: one pass per page, parallel tiles, or header and "
+                             "totals only, skipping line items (saved with ocr_partial set) "
+                             "(default: page)")
+    args = parser.parse_args(argv)
+
+    if not args.sources and not args.file_list:
+        parser.error("give at least one source directory/file or --file-list")
+
+    paths = collect_image_paths(args.sources, args.file_list)
+    if not paths:
+        print("No images found.")
+        return 0
+
+    ingester = BatchIngester(
+        ReceiptDatabase(args.db),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint,
+        allow_incomplete=args.allow_incomplete,
+        layout=args.layout,
+    )
+    stats = ingester.run(paths)
+
+    print("=" * 50)
+    print(f"Images found:    {stats['total']}")
+    print(f"Skipped (done):  {stats['skipped']}")
+    print(f"Processed:       {stats['processed']}")
+    print(f"Saved:           {stats['saved']}")
+    print(f"Failed:          {stats['failed']}")
+    print(f"Elapsed:         {stats['elapsed']:.1f}s")
+    print(f"Throughput:      {stats['images_per_sec']:.2f} images/sec")
+    for tier, count in stats['tiers'].items():
+        print(f"OCR tier {tier + ':':<15}{count}")
+
+    if ingester.failures:
+        print("\nFailures:")
+        for path, reason in ingester.failures:
+            print(f"  {path}: {reason}")
+
+    return 1 if ingester.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
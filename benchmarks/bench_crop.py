@@ -0,0 +1,65 @@
+"""
+Measure what receipt cropping saves in ReceiptOCR preprocessing
+
+Renders synthetic receipts onto a larger background (like a phone photo
+of a receipt on a table), then preprocesses each one with and without the
+crop stage and reports the area kept and the time saved per image.
+
+Usage:
+    python benchmarks/bench_crop.py [--images 5] [--profile full_resolution]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_processor import PREPROCESS_PROFILES, ReceiptOCR
+from synthetic import generate_receipt_text, render_receipt_image
+
+
+def timed_preprocess(ocr, image):
+    start = time.perf_counter()
+    ocr.preprocess_image(image)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark receipt cropping")
+    parser.add_argument('--images', type=int, default=5, help="Number of synthetic photos (default: 5)")
+    parser.add_argument('--profile', default='full_resolution',
+                        help="Preprocessing profile to compare with crop on/off (default: full_resolution)")
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    without_crop = ReceiptOCR({**PREPROCESS_PROFILES[args.profile], 'crop': False}, cache_bytes=0)
+    with_crop = ReceiptOCR({**PREPROCESS_PROFILES[args.profile], 'crop': True}, cache_bytes=0)
+
+    saved = []
+    print(f"{'image':>5} {'size':>11} {'area kept':>9} {'no crop':>8} {'crop':>8} {'saved':>8}")
+    for i in range(args.images):
+        photo = render_receipt_image(generate_receipt_text(rng), background=(3000, 3000),
+                                     angle=rng.uniform(-8, 8))
+        image = np.asarray(photo)
+        gray = image.mean(axis=2).astype(np.uint8)
+
+        _, area_kept = with_crop.crop_to_receipt(gray)
+        full_time = timed_preprocess(without_crop, image)
+        crop_time = timed_preprocess(with_crop, image)
+        saved.append(full_time - crop_time)
+
+        print(f"{i:>5} {photo.width:>5}x{photo.height:<5} {area_kept:>8.0%} "
+              f"{full_time:>7.2f}s {crop_time:>7.2f}s {full_time - crop_time:>7.2f}s")
+
+    print(f"Average time saved per image: {sum(saved) / len(saved):.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Measure peak memory of decoding + preprocessing one upload
+
+Encodes synthetic phone photos as JPEG (the way they arrive from the
+uploader), then OCR-preprocesses each one in a fresh process, two ways:
+- rgb:    Image.open -> convert('RGB') -> numpy array -> preprocess (the old path)
+- direct: ReceiptOCR.load_image (grayscale, reduced-size decode) -> preprocess
+
+Each measurement runs in its own spawned process so ru_maxrss (the peak
+resident set size) only reflects that one image; the process's RSS after
+imports is subtracted.
+
+Usage:
+    python benchmarks/bench_decode.py [--images 3] [--megapixels 24] [--profile default]
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import generate_receipt_text, render_receipt_image
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def preprocess_upload(data, mode, profile):
+    """Decode and preprocess one upload (runs in a fresh process)"""
+    import numpy as np
+    from PIL import Image
+
+    from ocr_processor import ReceiptOCR
+
+    ocr = ReceiptOCR(profile, cache_bytes=0, backend='pytesseract')
+    baseline = _peak_rss_mb()
+
+    start = time.perf_counter()
+    if mode == 'rgb':
+        with Image.open(io.BytesIO(data)) as image:
+            ocr.preprocess_image(np.array(image.convert('RGB')))
+    else:
+        ocr.preprocess_image(ocr.load_image(data))
+    return _peak_rss_mb() - baseline, time.perf_counter() - start
+
+
+def make_upload(rng, megapixels):
+    """A receipt photo of about the given size, JPEG-encoded"""
+    text = generate_receipt_text(rng)
+    paper = render_receipt_image(text, scale=2.5)
+    side = int((megapixels * 1_000_000) ** 0.5)
+    photo = render_receipt_image(text, scale=2.5,
+                                 background=(max(side, paper.width), max(side, paper.height)),
+                                 angle=rng.uniform(-4, 4))
+    buffer = io.BytesIO()
+    photo.save(buffer, 'JPEG', quality=90)
+    return photo.size, buffer.getvalue()
+
+
+def measure(data, mode, profile):
+    # A new process per measurement so every peak starts from scratch
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(preprocess_upload, data, mode, profile).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark upload decode memory")
+    parser.add_argument('--images', type=int, default=3, help="Number of synthetic photos (default: 3)")
+    parser.add_argument('--megapixels', type=float, default=24,
+                        help="Approximate photo size in megapixels (default: 24)")
+    parser.add_argument('--profile', default='default', help="Preprocessing profile (default: default)")
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    ratios = []
+    print(f"{'image':>5} {'size':>11} {'rgb peak':>9} {'direct peak':>11} {'rgb':>7} {'direct':>7}")
+    for i in range(args.images):
+        (width, height), data = make_upload(rng, args.megapixels)
+        rgb_mb, rgb_time = measure(data, 'rgb', args.profile)
+        direct_mb, direct_time = measure(data, 'direct', args.profile)
+        ratios.append(rgb_mb / max(direct_mb, 1e-9))
+
+        print(f"{i:>5} {width:>5}x{height:<5} {rgb_mb:>7.0f}MB {direct_mb:>9.0f}MB "
+              f"{rgb_time:>6.2f}s {direct_time:>6.2f}s")
+
+    print(f"Peak RSS reduction: {sum(ratios) / len(ratios):.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Compare ReceiptOCR layouts on long receipts
+
+Renders synthetic receipts with many line items and reads each one with
+the 'page', 'tiles' and 'totals' layouts. Reports the number of tesseract
+calls, the share of the page area they covered and the OCR latency. Without
+Tesseract only the tile counts of 'page' and 'tiles' are reported ('totals'
+needs real text to know when it has reached the SUBTOTAL line).
+
+Usage:
+    python benchmarks/bench_layout.py [--images 3] [--items 80] [--profile grayscale]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_backends import OCRBackend, get_backend
+from ocr_processor import LAYOUTS, ReceiptOCR
+from synthetic import ITEM_CODES, render_receipt_image
+
+
+class CountingBackend(OCRBackend):
+    """Wraps a backend (or stands in for one) and counts the calls and rows it gets"""
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.name = backend.name if backend else 'counting'
+        self.calls = 0
+        self.rows = 0
+
+    def image_to_string(self, image, config=''):
+        self.calls += 1
+        self.rows += image.shape[0]
+        return self.backend.image_to_string(image, config) if self.backend else ''
+
+
+def long_receipt_text(rng, items):
+    lines = ['WALMART', f"ST# 0{rng.randint(1000, 9999)} OP# 00{rng.randint(1000, 9999)}"]
+    subtotal = 0.0
+    for _ in range(items):
+        name, code = rng.choice(list(ITEM_CODES.items()))
+        price = rng.randint(50, 3000) / 100
+        subtotal += price
+        lines.append(f"{name} {code} F {price:.2f} N")
+    lines += [f"SUBTOTAL {subtotal:.2f}", f"TAX 1 7.000 % {subtotal * 0.07:.2f}",
+              f"TOTAL {subtotal * 1.07:.2f}", "TRANS ID - 7K3QX9", "02/07/2026 14:22:01"]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OCR layouts")
+    parser.add_argument('--images', type=int, default=3, help="Number of receipts (default: 3)")
+    parser.add_argument('--items', type=int, default=80, help="Line items per receipt (default: 80)")
+    parser.add_argument('--profile', default='grayscale', help="Preprocessing profile (default: grayscale)")
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args(argv)
+
+    engine = get_backend('auto') if shutil.which('tesseract') else None
+    if engine is None:
+        print("(no Tesseract found, reporting tile counts and area only)")
+
+    rng = random.Random(args.seed)
+    images = [np.asarray(render_receipt_image(long_receipt_text(rng, args.items)))
+              for _ in range(args.images)]
+
+    print(f"{'layout':>8} {'calls':>7} {'area':>6} {'seconds':>8}")
+    for layout in LAYOUTS:
+        if engine is None and layout == 'totals':
+            print(f"{layout:>8} {'-':>7} {'-':>6} {'-':>8}")
+            continue
+        backend = CountingBackend(engine)
+        ocr = ReceiptOCR(args.profile, cache_bytes=0, backend=backend, layout=layout)
+        pages = 0
+        elapsed = 0.0
+        for image in images:
+            processed = ocr.preprocess_image(image)
+            pages += processed.shape[0]
+            start = time.perf_counter()
+            ocr._ocr(processed)
+            elapsed += time.perf_counter() - start
+
+        ocr.close()
+
+        seconds = f"{elapsed / len(images):.2f}" if engine else '-'
+        print(f"{layout:>8} {backend.calls / len(images):>7.1f} {backend.rows / pages:>6.0%} {seconds:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
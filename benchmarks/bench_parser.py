@@ -0,0 +1,131 @@
+"""
+Benchmark ReceiptParser against the original regex-per-field parser
+
+Checks that both produce identical header fields on a synthetic corpus plus
+a set of edge cases, then times them (the current parser also extracts line
+items, so it does more work per receipt).
+
+Usage:
+    python benchmarks/bench_parser.py [--size 5000] [--workers 4]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from receipt_parser import ReceiptParser
+from synthetic import generate_corpus
+
+EDGE_CASES = [
+    '',
+    'nothing to see here',
+    'SUB TOTAL 5\nSUBTOTAL 6',
+    'SUB TOTAL 7.50',
+    'SALES TAX 1.00\nTAX 2.00',
+    'TOTAL\n\n12.00',
+    'TOTAL SAVINGS\nTOTAL 9.99',
+    'sub-total 4.00 total 4.28',
+    '1/5/24 then 12/05/2024',
+    'TRANSACTION ID:x9z trans id Y7',
+    'Wälmart TOTAL 5 ß sub total 3 trans id abc 1/2/24',
+    # Labels with their value on a later line
+    'SUB\nTOTAL 3.00\nTAX\n\n0.21\nTOTAL\n3.21',
+    'SUBTOTAL\n4.00 TRANS\nID\nQ77\nAMOUNT DUE\n4.28',
+    'TAX EXEMPT\nSUB TOTAL\nTAX 0.50 SUBTOTAL 2.00',
+]
+
+
+def legacy_parse_walmart_receipt(ocr_text):
+    """The original parser: one uncompiled re.search per pattern"""
+    result = {
+        'store_name': None,
+        'date': None,
+        'subtotal': None,
+        'tax': None,
+        'total': None,
+        'transaction_id': None
+    }
+
+    if 'walmart' in ocr_text.lower():
+        result['store_name'] = 'Walmart'
+
+    for pattern in [r'(\d{2}[/-]\d{2}[/-]\d{4})', r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})']:
+        match = re.search(pattern, ocr_text)
+        if match:
+            result['date'] = match.group(1)
+            break
+
+    fields = [
+        ('subtotal', [r'SUBTOTAL\s*\$?(\d+\.?\d*)', r'SUB[\s-]?TOTAL\s*\$?(\d+\.?\d*)']),
+        ('tax', [r'TAX\s*\$?(\d+\.?\d*)', r'SALES TAX\s*\$?(\d+\.?\d*)']),
+        ('total', [r'(?<!SUB)TOTAL\s*\$?(\d+\.?\d*)', r'\bTOTAL\s*\$?(\d+\.?\d*)',
+                   r'AMOUNT DUE\s*\$?(\d+\.?\d*)']),
+        ('transaction_id', [r'TRANS(?:ACTION)?\s*ID\s*[-:]?\s*([A-Z0-9]+)',
+                            r'TRANS\s*ID\s*[-:]?\s*([A-Z0-9]+)']),
+    ]
+    for field, patterns in fields:
+        for pattern in patterns:
+            match = re.search(pattern, ocr_text, re.IGNORECASE)
+            if match:
+                value = match.group(1)
+                result[field] = value if field == 'transaction_id' else float(value)
+                break
+
+    return result
+
+
+def time_per_text(parse, texts, repeat=3):
+    """Best-of-repeat average microseconds per text"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            parse(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+
+def header_fields(parsed):
+    """Fields the legacy parser knows about (it has no line items)"""
+    return {field: value for field, value in parsed.items() if field != 'items'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the receipt parser")
+    parser.add_argument('--size', type=int, default=5000, help="Synthetic corpus size (default: 5000)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processes for the parse_many run (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    receipt_parser = ReceiptParser()
+    corpus = generate_corpus(args.size) + EDGE_CASES
+
+    mismatches = [text for text in corpus
+                  if legacy_parse_walmart_receipt(text)
+                  != header_fields(receipt_parser.parse_walmart_receipt(text))]
+    print(f"Corpus: {len(corpus)} texts, {len(mismatches)} mismatch(es)")
+    for text in mismatches[:5]:
+        print(f"  MISMATCH: {text[:80]!r}")
+        print(f"    legacy: {legacy_parse_walmart_receipt(text)}")
+        print(f"    new:    {receipt_parser.parse_walmart_receipt(text)}")
+
+    legacy_us = time_per_text(legacy_parse_walmart_receipt, corpus)
+    new_us = time_per_text(receipt_parser.parse_walmart_receipt, corpus)
+    print(f"Legacy parser:  {legacy_us:8.1f} us/receipt")
+    print(f"Current parser: {new_us:8.1f} us/receipt  ({legacy_us / new_us:.1f}x faster)")
+
+    bulk = corpus * 10
+    start = time.perf_counter()
+    receipt_parser.parse_many(bulk, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"parse_many:     {len(bulk) / elapsed:8.0f} receipts/sec over {len(bulk)} texts")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
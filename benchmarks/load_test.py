@@ -0,0 +1,197 @@
+"""
+Load test for ingest_server.py
+
+Uploads synthetic receipt images to a running ingest server from several
+concurrent keep-alive connections and reports throughput, latency and how
+many uploads were turned away with 429. Run it at a few concurrency levels
+(and against servers started with different --workers) to size the pool.
+
+Usage:
+    python ingest_server.py --workers 4 --db /tmp/load.db &
+    python benchmarks/load_test.py --requests 200 --concurrency 1,4,8,16
+    python benchmarks/load_test.py --concurrency 32 --retry --no-save
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_receipt_text, render_receipt_image
+
+
+def make_uploads(count, seed):
+    """PNG bytes of count synthetic receipts"""
+    rng = random.Random(seed)
+    uploads = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        render_receipt_image(generate_receipt_text(rng)).save(buffer, 'PNG')
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection (reopened when the server closes it)"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b''):
+        """Returns: (status, headers, body bytes)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+
+        lines = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ')[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, headers, payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+async def run_level(host, port, uploads, requests, concurrency, query, retry):
+    """Send requests uploads from concurrency connections; returns result stats"""
+    latencies = []
+    statuses = {}
+    tiers = {}
+    next_index = 0
+
+    async def client():
+        nonlocal next_index
+        connection = Connection(host, port)
+        try:
+            while next_index < requests:
+                index = next_index
+                next_index += 1
+                body = uploads[index % len(uploads)]
+                start = time.perf_counter()
+                while True:
+                    try:
+                        status, headers, payload = await connection.request(
+                            'POST', f"/receipts?name=load_{index}.png{query}", body)
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        # Dropped connection (status 0), e.g. closed after a 429
+                        # before the whole upload was sent
+                        await connection.close()
+                        status, headers, payload = 0, {}, b''
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status in (0, 429) and retry:
+                        await asyncio.sleep(float(headers.get('retry-after', 1)))
+                        continue
+                    break
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                    tier = json.loads(payload).get('ocr_tier')
+                    tiers[tier] = tiers.get(tier, 0) + 1
+        finally:
+            await connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    samples = np.asarray(latencies) if latencies else np.zeros(1)
+    return {
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'statuses': statuses,
+        'tiers': tiers,
+        'elapsed': elapsed,
+        'throughput_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'max_ms': float(samples.max() * 1000),
+    }
+
+
+async def fetch_json(host, port, path):
+    connection = Connection(host, port)
+    try:
+        status, _, payload = await connection.request('GET', path)
+        return json.loads(payload) if status == 200 else None
+    finally:
+        await connection.close()
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    health = await fetch_json(host, port, '/health')
+    print(f"Server: {health}")
+
+    uploads = make_uploads(args.images, args.seed)
+    query = '&save=0' if args.no_save else ''
+
+    print(f"\n{'conc':>5} {'ok':>6} {'429':>6} {'other':>6} {'per sec':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    results = []
+    for concurrency in args.concurrency:
+        stats = await run_level(host, port, uploads, args.requests, concurrency, query, args.retry)
+        results.append(stats)
+        other = sum(count for status, count in stats['statuses'].items() if status not in (200, 429))
+        print(f"{concurrency:>5} {stats['ok']:>6} {stats['statuses'].get(429, 0):>6} {other:>6} "
+              f"{stats['throughput_per_sec']:>8.2f} {stats['p50_ms']:>9.0f} "
+              f"{stats['p95_ms']:>9.0f} {stats['max_ms']:>9.0f}")
+
+    server_metrics = await fetch_json(host, port, '/metrics?format=json')
+    if server_metrics:
+        service = server_metrics['service']
+        print(f"\nServer saved {service['saved']} receipt(s) in {service['write_batches']} "
+              f"write batch(es); average OCR time {service['avg_ocr_seconds'] or 0:.2f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'server': health, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the receipt ingest server")
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help="Server URL (default: http://127.0.0.1:8080)")
+    parser.add_argument('--requests', type=int, default=100, help="Uploads per concurrency level (default: 100)")
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help="Comma-separated numbers of concurrent connections (default: 1,4,16)")
+    parser.add_argument('--images', type=int, default=10, help="Distinct synthetic images to cycle (default: 10)")
+    parser.add_argument('--retry', action='store_true', help="Retry 429s after Retry-After instead of counting them")
+    parser.add_argument('--no-save', action='store_true', help="Only parse, don't save receipts")
+    parser.add_argument('--output', help="Also write the results as JSON")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
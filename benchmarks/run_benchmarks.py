@@ -0,0 +1,311 @@
+"""
+End-to-end benchmark suite
+
+Times each stage separately on synthetic data:
+- preprocess_image sub-steps (per profile stage) on synthetic receipt photos
+- extract_text and the read_receipt OCR cascade (skipped when no Tesseract
+  is available)
+- parse_walmart_receipt
+- add_receipt / add_receipts and the dashboard queries (uncached, and again
+  served from the query cache) at several table sizes,
+  plus the database size per receipt next to the OCR text it stores
+
+Reports throughput and p50/p95 latency, writes the results as JSON and
+flags regressions against a stored baseline.
+
+Usage:
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --rows 1000,100000
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --threshold 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import ReceiptDatabase
+from ocr_processor import ReceiptOCR
+from receipt_parser import ReceiptParser
+from synthetic import generate_corpus, make_receipt_photo
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results', 'latest.json')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def summarize(samples):
+    """Latency stats (seconds in, milliseconds out) for a list of samples"""
+    samples = np.asarray(samples, dtype=float)
+    total = samples.sum()
+    return {
+        'n': int(len(samples)),
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'mean_ms': float(samples.mean() * 1000),
+        'throughput_per_sec': float(len(samples) / total) if total > 0 else None,
+    }
+
+
+def measure(func, repeat):
+    """Call func repeat times and return the per-call durations"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def tesseract_available(ocr):
+    if ocr.backend.name != 'pytesseract':
+        return True
+    return shutil.which('tesseract') is not None
+
+
+def bench_ocr(results, images, profile):
+    """Preprocessing stages and full extract_text"""
+    ocr = ReceiptOCR(profile, cache_bytes=0)
+
+    stage_samples = {}
+    total_samples = []
+    for image in images:
+        timings = {}
+        start = time.perf_counter()
+        ocr._preprocess(image, timings)
+        total_samples.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stage_samples.setdefault(stage, []).append(seconds)
+
+    for stage, samples in stage_samples.items():
+        results[f'preprocess.{profile}.{stage}'] = summarize(samples)
+    results[f'preprocess.{profile}.total'] = summarize(total_samples)
+
+    if not tesseract_available(ocr):
+        print("  (no Tesseract found, skipping extract_text)")
+        return
+    results[f'extract_text.{profile}'] = summarize(
+        [measure(lambda: ocr.extract_text(image), 1)[0] for image in images]
+    )
+
+    # The cascade, with how many images each tier had to handle
+    parser = ReceiptParser()
+    tiers = {}
+    samples = []
+    for image in images:
+        start = time.perf_counter()
+        tier = ocr.read_receipt(image, parser)['tier']
+        samples.append(time.perf_counter() - start)
+        tiers[tier] = tiers.get(tier, 0) + 1
+    results[f'read_receipt.{profile}'] = dict(summarize(samples), tiers=tiers)
+
+
+def bench_parser(results, texts):
+    parser = ReceiptParser()
+    results['parse_walmart_receipt'] = summarize(
+        [measure(lambda: parser.parse_walmart_receipt(text), 1)[0] for text in texts]
+    )
+
+    start = time.perf_counter()
+    parser.parse_many(texts, workers=1)
+    elapsed = time.perf_counter() - start
+    results['parse_many'] = {'n': len(texts), 'throughput_per_sec': len(texts) / elapsed}
+
+
+def fill_database(db, rows, texts, rng, chunk=50_000):
+    """Bulk-load synthetic receipts; returns rows/sec"""
+    stores = ['Walmart', 'Target', 'Costco', 'Kroger', 'Aldi']
+    start = time.perf_counter()
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            subtotal = round(rng.uniform(1, 300), 2)
+            batch.append({
+                'store_name': rng.choice(stores),
+                'date': f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.choice([2023, 2024, 2025])}",
+                'subtotal': subtotal,
+                'tax': round(subtotal * 0.07, 2),
+                'total': round(subtotal * 1.07, 2),
+                'transaction_id': f"T{i:09d}",
+                'raw_ocr_text': texts[i % len(texts)],
+            })
+        db.add_receipts(batch)
+    return rows / (time.perf_counter() - start)
+
+
+def database_size(path, rows, texts):
+    """Bytes in use per receipt (WAL included) and the OCR text bytes it stores"""
+    conn = sqlite3.connect(path)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        used_pages = (conn.execute("PRAGMA page_count").fetchone()[0]
+                      - conn.execute("PRAGMA freelist_count").fetchone()[0])
+    finally:
+        conn.close()
+    text_bytes = sum(len(texts[i % len(texts)].encode('utf-8')) for i in range(rows))
+    return {'n': rows, 'bytes_per_receipt': used_pages * page_size / rows,
+            'ocr_text_bytes_per_receipt': text_bytes / rows}
+
+
+def bench_database(results, rows, texts, repeat, workdir):
+    rng = random.Random(rows)
+    path = os.path.join(workdir, f'bench_{rows}.db')
+    # With the query cache on, every sample after the first would be a
+    # cache hit; these time the SQL and its indexes
+    db = ReceiptDatabase(path, query_cache_entries=0)
+    prefix = f'db.{rows}'
+
+    results[f'{prefix}.add_receipts'] = {
+        'n': rows, 'throughput_per_sec': fill_database(db, rows, texts, rng)
+    }
+    results[f'{prefix}.size'] = database_size(path, rows, texts)
+    results[f'{prefix}.add_receipt'] = summarize(measure(
+        lambda: db.add_receipt('Walmart', '01/15/2025', 10.0, 0.7, 10.7, 'BENCH', None, texts[0]),
+        repeat
+    ))
+
+    queries = {
+        'get_spending_summary': lambda db: db.get_spending_summary(),
+        'get_monthly_summary': lambda db: db.get_monthly_summary(),
+        'count_receipts': lambda db: db.count_receipts(),
+        'get_receipts_page': lambda db: db.get_receipts_page(page_size=50),
+        'get_spending_between': lambda db: db.get_spending_between('2024-03-01', '2024-03-31', 'Walmart'),
+    }
+    for name, query in queries.items():
+        results[f'{prefix}.{name}'] = summarize(measure(lambda: query(db), repeat))
+    db.close()
+
+    # The same queries answered from the query cache (the dashboard reruns)
+    cached_db = ReceiptDatabase(path)
+    for name, query in queries.items():
+        query(cached_db)
+        results[f'{prefix}.{name}.cached'] = summarize(measure(lambda: query(cached_db), repeat))
+    cached_db.close()
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare against a baseline run
+    Returns: list of (name, metric, baseline value, current value) regressions
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'bytes_per_receipt'):
+            if current.get(metric) and previous.get(metric):
+                if current[metric] > previous[metric] * (1 + threshold):
+                    regressions.append((name, metric, previous[metric], current[metric]))
+        if current.get('throughput_per_sec') and previous.get('throughput_per_sec') \
+                and 'p50_ms' not in current:
+            if current['throughput_per_sec'] < previous['throughput_per_sec'] / (1 + threshold):
+                regressions.append((name, 'throughput_per_sec',
+                                    previous['throughput_per_sec'], current['throughput_per_sec']))
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'benchmark':<44} {'n':>8} {'p50 ms':>10} {'p95 ms':>10} {'per sec':>12}")
+    for name, stats in results.items():
+        if 'bytes_per_receipt' in stats:
+            print(f"{name:<44} {stats['n']:>8} {stats['bytes_per_receipt']:>10.0f} bytes per receipt "
+                  f"(OCR text alone: {stats['ocr_text_bytes_per_receipt']:.0f})")
+            continue
+        p50 = f"{stats['p50_ms']:.3f}" if 'p50_ms' in stats else '-'
+        p95 = f"{stats['p95_ms']:.3f}" if 'p95_ms' in stats else '-'
+        rate = f"{stats['throughput_per_sec']:.1f}" if stats.get('throughput_per_sec') else '-'
+        print(f"{name:<44} {stats['n']:>8} {p50:>10} {p95:>10} {rate:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the receipt pipeline benchmark suite")
+    parser.add_argument('--images', type=int, default=5, help="Synthetic photos for OCR stages (default: 5)")
+    parser.add_argument('--texts', type=int, default=2000, help="Synthetic texts for parsing (default: 2000)")
+    parser.add_argument('--rows', default='1000,100000,1000000',
+                        help="Comma-separated table sizes for database benchmarks (default: 1000,100000,1000000)")
+    parser.add_argument('--repeat', type=int, default=50, help="Samples per database query (default: 50)")
+    parser.add_argument('--profiles', default='default',
+                        help="Comma-separated preprocessing profiles (default: default)")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--quick', action='store_true', help="Small run: 2 images, 500 texts, 1000 rows")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression (default: 0.2)")
+    parser.add_argument('--save-baseline', action='store_true', help="Also store these results as the baseline")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.images, args.texts, args.rows, args.repeat = 2, 500, '1000', 20
+
+    rng = random.Random(args.seed)
+    texts = generate_corpus(args.texts, seed=args.seed)
+    results = {}
+
+    print(f"Rendering {args.images} synthetic receipt photo(s)...")
+    images = [np.asarray(make_receipt_photo(rng)[0]) for _ in range(args.images)]
+    for profile in args.profiles.split(','):
+        print(f"OCR stages ({profile})...")
+        bench_ocr(results, images, profile)
+
+    print("Parser...")
+    bench_parser(results, texts)
+
+    workdir = tempfile.mkdtemp(prefix='receipt_bench_')
+    try:
+        for rows in (int(r) for r in args.rows.split(',')):
+            print(f"Database with {rows} rows...")
+            bench_database(results, rows, texts, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'args': vars(args),
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    exit_code = 0
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nREGRESSIONS (more than {args.threshold:.0%} slower or larger than baseline):")
+            for name, metric, before, after in regressions:
+                print(f"  {name} {metric}: {before:.3f} -> {after:.3f}")
+            exit_code = 1
+        else:
+            print(f"\nNo regressions against {args.baseline}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Synthetic Walmart-style receipt data for benchmarks
+
+Everything is driven by a seeded random.Random, so the same seed always
+produces the same corpus.
+"""
+
+import random
+
+ITEM_NAMES = [
+    'GV MILK 2%', 'GV WHOLE MILK', 'GREAT VALUE EGGS', 'BREAD', 'BANANAS',
+    'TIDE PODS', 'COCA COLA 12PK', 'CHEERIOS', 'PAPER TOWEL', 'CHICKEN BRST',
+    'GROUND BEEF', 'CHEDDAR CHEESE', 'APPLES GALA', 'TOOTHPASTE', 'DOG FOOD',
+]
+
+# Every product keeps one UPC, like a real store's catalogue
+ITEM_CODES = {name: f"{index * 7919 + 1000:012d}" for index, name in enumerate(ITEM_NAMES)}
+
+HEADERS = [
+    'WALMART',
+    'Walmart Supercenter',
+    'Save money. Live better.\nWalmart',
+    'WAL*MART',
+]
+
+
+def generate_receipt_text(rng):
+    """Generate one receipt's OCR-like text, including common OCR variations"""
+    lines = []
+    if rng.random() < 0.9:
+        lines.append(rng.choice(HEADERS))
+    lines.append(f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}")
+    lines.append(f"ST# 0{rng.randint(1000, 9999)} OP# 00{rng.randint(1000, 9999)} "
+                 f"TE# {rng.randint(1, 99)} TR# 0{rng.randint(1000, 9999)}")
+
+    subtotal = 0.0
+    for _ in range(rng.randint(3, 40)):
+        price = rng.randint(0, 3000) / 100
+        subtotal += price
+        name = rng.choice(ITEM_NAMES)
+        lines.append(f"{name} {ITEM_CODES[name]} F "
+                     f"{price:.2f} {rng.choice('NXT')}")
+        if rng.random() < 0.1:
+            lines.append(f"2 AT 1 FOR {price / 2:.2f}")
+    if rng.random() < 0.2:
+        lines.insert(rng.randint(1, len(lines)), "TOTAL SAVINGS 3.00")
+
+    tax = subtotal * 0.07
+    total = subtotal + tax
+    lines.append(f"{rng.choice(['SUBTOTAL', 'SUB TOTAL', 'SUB-TOTAL', 'subtotal', 'SUBTOTAL' + chr(10)])} "
+                 f"{rng.choice(['', '$'])}{subtotal:.2f}")
+    lines.append(rng.choice(['TAX 1 7.000 % {:.2f}', 'SALES TAX {:.2f}', 'TAX {:.2f}', 'tax\n{:.2f}']).format(tax))
+    lines.append(f"{rng.choice(['TOTAL', 'TOTAL $', 'total', 'AMOUNT DUE'])} {total:.2f}")
+    lines.append(f"DEBIT TEND {total:.2f}")
+
+    if rng.random() < 0.8:
+        trans_id = ''.join(rng.choice('ABCDEFGHJK0123456789') for _ in range(rng.randint(6, 12)))
+        lines.append(rng.choice(['TRANS ID - ', 'TRANSACTION ID: ', 'trans id ', 'TRANS ID\n']) + trans_id)
+
+    date_format = rng.choice(['{:02d}/{:02d}/{}', '{}/{}/{}', '{:02d}-{:02d}-{}'])
+    year = rng.choice([2024, 25, 2026])
+    lines.append(date_format.format(rng.randint(1, 12), rng.randint(1, 28), year) +
+                 f" {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}")
+    if rng.random() < 0.3:
+        lines.append(f"# ITEMS SOLD {rng.randint(1, 40)}")
+
+    return '\n'.join(lines)
+
+
+def generate_corpus(size, seed=7):
+    """Generate a reproducible list of receipt texts"""
+    rng = random.Random(seed)
+    return [generate_receipt_text(rng) for _ in range(size)]
+
+
+def render_receipt_image(text, scale=1.0, background=None, angle=0.0):
+    """
+    Render receipt text onto white paper with PIL
+    scale: multiplies font size and paper size (1.0 ~ 20 px cap height)
+    background: (width, height) of a darker surface to place the paper on
+    angle: rotation of the paper in degrees
+    Returns: RGB PIL Image
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    lines = text.split('\n')
+    line_height = int(40 * scale)
+    margin = int(20 * scale)
+    paper = Image.new('RGB', (int(900 * scale), line_height * (len(lines) + 2)), 'white')
+    draw = ImageDraw.Draw(paper)
+    font = ImageFont.load_default(size=int(28 * scale))
+    for i, line in enumerate(lines):
+        draw.text((margin, line_height * (i + 1)), line, fill='black', font=font)
+
+    surface_color = (90, 70, 50)
+    if angle:
+        paper = paper.rotate(angle, expand=True, resample=Image.BICUBIC, fillcolor=surface_color)
+    if background is None:
+        return paper
+
+    surface = Image.new('RGB', background, surface_color)
+    surface.paste(paper, ((background[0] - paper.width) // 2, (background[1] - paper.height) // 2))
+    return surface
+
+
+def make_receipt_photo(rng, text=None):
+    """
+    Render a receipt the way a phone photo might look: random resolution,
+    a slight rotation on a darker surface, and sensor noise
+    Returns: (RGB PIL Image, receipt text)
+    """
+    import numpy as np
+    from PIL import Image
+
+    if text is None:
+        text = generate_receipt_text(rng)
+
+    scale = rng.uniform(0.6, 2.5)
+    paper = render_receipt_image(text, scale=scale)
+    margin = rng.uniform(0.1, 0.8)
+    background = (int(paper.width * (1 + 2 * margin)), int(paper.height * (1 + margin)))
+    photo = render_receipt_image(text, scale=scale, background=background,
+                                 angle=rng.uniform(-5, 5))
+
+    pixels = np.asarray(photo, dtype=np.int16)
+    noise = np.random.default_rng(rng.randrange(2**32)).normal(0, rng.uniform(2, 12), pixels.shape)
+    pixels = np.clip(pixels + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels), text
@@ -1,106 +1,1250 @@
+import functools
+import queue
+import re
 import sqlite3
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 import pandas as pd
 
+from instrumentation import metrics
+
+# Columns written by add_receipt/add_receipts, in insert order
+INSERT_COLUMNS = ('store_name', 'date', 'date_iso', 'subtotal', 'tax', 'total',
+                  'transaction_id', 'image_path', 'created_at', 'parser_version',
+                  'edited_fields', 'ocr_partial')
+
+# Name of the OCR text in receipt_blobs (the table is keyed by receipt and name,
+# so other per-receipt blobs can live next to it)
+OCR_TEXT_BLOB = 'raw_ocr_text'
+
+# Parsed header fields that update_parsed_receipts can replace (unless they
+# are listed in the row's edited_fields)
+PARSED_FIELDS = ('store_name', 'date', 'subtotal', 'tax', 'total', 'transaction_id')
+
+# Columns of receipt_items written by add_receipts, in insert order
+ITEM_COLUMNS = ('receipt_id', 'line_no', 'description', 'item_code', 'quantity', 'price')
+
+# Columns shown in receipt listings
+DISPLAY_COLUMNS = ('id', 'store_name', 'date', 'subtotal', 'tax', 'total',
+                   'transaction_id', 'created_at')
+
+# Sort keys accepted by get_receipts_page, mapped to NULL-free SQL expressions
+# so they can be used in keyset comparisons
+SORT_KEYS = {
+    'date': "date_iso",
+    'id': "id",
+    'total': "IFNULL(total, 0)",
+    'created_at': "IFNULL(created_at, '')",
+}
+
+# Period lengths accepted by get_spending_timeseries, as pandas resample rules
+# (weeks start on Monday, months on the 1st)
+TIMESERIES_FREQUENCIES = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+# Schema version stored in PRAGMA user_version; see ReceiptDatabase._migrate
+SCHEMA_VERSION = 13
+
+_ISO_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+_US_DATE_RE = re.compile(r'(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})')
+
+# A search term: a "quoted phrase" or a bare word, either one optionally
+# followed by * for prefix matching
+_SEARCH_TERM_RE = re.compile(r'"([^"]*)"(\*?)|([^\s"]+)')
+
+# A token as split by FTS5's default unicode61 tokenizer
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+# contentless_delete (SQLite 3.43+) lets a contentless FTS5 table drop rows
+# by rowid; older versions need the indexed text to remove a row
+FTS_CONTENTLESS_DELETE = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+
+def normalize_date(date_text):
+    """
+    Convert a receipt date (MM/DD/YYYY, M/D/YY, with '/' or '-', or ISO)
+    to ISO-8601 YYYY-MM-DD
+    Returns: ISO date string, or None if the text is not a valid date
+    """
+    if not date_text:
+        return None
+
+    match = _ISO_DATE_RE.search(date_text)
+    if match:
+        year, month, day = (int(part) for part in match.groups())
+    else:
+        match = _US_DATE_RE.search(date_text)
+        if not match:
+            return None
+        month, day, year = (int(part) for part in match.groups())
+        if len(match.group(3)) == 2:
+            # Same pivot as strptime's %y: 69-99 -> 1900s, 00-68 -> 2000s
+            year += 1900 if year >= 69 else 2000
+        elif len(match.group(3)) == 3:
+            return None
+
+    try:
+        return datetime(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _compress_text(text):
+    """zlib-compress text for receipt_blobs (None stays None)"""
+    return None if text is None else zlib.compress(text.encode('utf-8'))
+
+
+def _decompress_text(data):
+    """Inverse of _compress_text"""
+    return None if data is None else zlib.decompress(data).decode('utf-8')
+
+
+def _search_terms(text):
+    """Split search text into (phrase, prefix) pairs; see fts_query"""
+    terms = []
+    for match in _SEARCH_TERM_RE.finditer(text or ''):
+        phrase, phrase_star, word = match.groups()
+        if word is not None:
+            prefix = word.endswith('*')
+            phrase = word.rstrip('*')
+        else:
+            prefix = bool(phrase_star)
+        if phrase.strip():
+            terms.append((phrase, prefix))
+    return terms
+
+
+def fts_query(text):
+    """
+    Turn search text typed by a user into an FTS5 MATCH expression
+    Every word or "quoted phrase" must appear; a trailing * matches a prefix.
+    Terms are quoted, so FTS5 operators in the text are matched literally.
+    Returns: MATCH expression, or None if the text has no search terms
+    """
+    terms = ['"{}"{}'.format(phrase.replace('"', '""'), '*' if prefix else '')
+             for phrase, prefix in _search_terms(text)]
+    return ' '.join(terms) or None
+
+
+def _fold_token(token):
+    """Case- and accent-fold a token the way the unicode61 tokenizer does"""
+    decomposed = unicodedata.normalize('NFKD', token.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def search_snippet(text, query, size=12):
+    """
+    Excerpt of text around the words of a search, like FTS5's snippet():
+    the size-token window with the most matching tokens, matches in
+    [brackets] and '…' where the text was cut
+    (the search index is contentless, so SQLite can't build snippets itself)
+    """
+    tokens = list(_TOKEN_RE.finditer(text or ''))
+    if not tokens:
+        return ''
+
+    words, prefixes = set(), []
+    for phrase, prefix in _search_terms(query):
+        phrase_tokens = [_fold_token(token) for token in _TOKEN_RE.findall(phrase)]
+        if prefix and phrase_tokens:
+            prefixes.append(phrase_tokens.pop())
+        words.update(phrase_tokens)
+    hits = []
+    for token in tokens:
+        folded = _fold_token(token.group())
+        hits.append(folded in words or any(folded.startswith(prefix) for prefix in prefixes))
+
+    start, best = 0, 0
+    for i, hit in enumerate(hits):
+        if hit and sum(hits[i:i + size]) > best:
+            start, best = i, sum(hits[i:i + size])
+    # Fill the window backwards when the best one runs off the end
+    start = max(0, min(start, len(tokens) - size))
+    end = min(len(tokens), start + size)
+
+    parts = ['…' if start > 0 else '']
+    position = tokens[start].start()
+    for token, hit in zip(tokens[start:end], hits[start:end]):
+        parts.append(text[position:token.start()])
+        parts.append(f"[{token.group()}]" if hit else token.group())
+        position = token.end()
+    parts.append('…' if end < len(tokens) else text[position:])
+    return ''.join(parts).strip()
+
+
+# Summary tables kept current by triggers on receipts, with their key
+# columns and the expression giving each key for a receipt row (NEW/OLD)
+SUMMARY_KEYS = {
+    'store_summary': {'store_name': "IFNULL({row}.store_name, '')"},
+    'monthly_summary': {'month': "substr({row}.date_iso, 1, 7)",
+                        'store_name': "IFNULL({row}.store_name, '')"},
+    'daily_summary': {'day': "{row}.date_iso",
+                      'store_name': "IFNULL({row}.store_name, '')"},
+}
+
+
+def _summary_add_sql(row):
+    """Trigger statements adding a receipt row (NEW/OLD) to the summary tables"""
+    statements = []
+    for table, keys in SUMMARY_KEYS.items():
+        values = ', '.join(expr.format(row=row) for expr in keys.values())
+        statements.append(f'''
+            INSERT INTO {table} ({', '.join(keys)}, num_receipts, total_spent, total_tax)
+            VALUES ({values}, 1, IFNULL({row}.total, 0), IFNULL({row}.tax, 0))
+            ON CONFLICT({', '.join(keys)}) DO UPDATE SET
+                num_receipts = num_receipts + 1,
+                total_spent = total_spent + excluded.total_spent,
+                total_tax = total_tax + excluded.total_tax;
+        ''')
+    return ''.join(statements)
+
+
+def _summary_remove_sql(row):
+    """Trigger statements removing a receipt row (NEW/OLD) from the summary tables"""
+    statements = []
+    for table, keys in SUMMARY_KEYS.items():
+        match = ' AND '.join(f"{key} = {expr.format(row=row)}" for key, expr in keys.items())
+        statements.append(f'''
+            UPDATE {table} SET
+                num_receipts = num_receipts - 1,
+                total_spent = total_spent - IFNULL({row}.total, 0),
+                total_tax = total_tax - IFNULL({row}.tax, 0)
+            WHERE {match};
+            DELETE FROM {table} WHERE {match} AND num_receipts <= 0;
+        ''')
+    return ''.join(statements)
+
+
+class QueryCache:
+    """
+    Memoized query results for one database state
+    Entries are tagged with the state token they were read under; the first
+    lookup with a different token drops everything. LRU bounded by entries.
+    """
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._state = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, state):
+        """Return (True, value) if cached under this state, else (False, None)"""
+        with self._lock:
+            if state != self._state:
+                self._entries.clear()
+                self._state = state
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, state, value):
+        """Remember a result read under state (ignored if the database moved on)"""
+        with self._lock:
+            if state != self._state:
+                return
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._state = None
+
+
+def _copy_result(value):
+    """Copy a cached result so callers can't modify the cached one"""
+    if isinstance(value, tuple):
+        return tuple(_copy_result(item) for item in value)
+    if isinstance(value, (pd.DataFrame, dict)):
+        return value.copy()
+    return value
+
+
+def _cached_query(method):
+    """Serve a read method from the query cache until the database changes"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.query_cache is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        state = self._data_state()
+        found, value = self.query_cache.get(key, state)
+        if not found:
+            value = method(self, *args, **kwargs)
+            self.query_cache.put(key, state, value)
+        return _copy_result(value)
+    return wrapper
+
+
 class ReceiptDatabase:
-    def __init__(self, db_name="receipts.db"):
+    def __init__(self, db_name="receipts.db", debug=False, read_pool_size=4,
+                 query_cache_entries=128):
+        """
+        Open the database with one long-lived writer connection and a small
+        pool of reader connections. WAL journaling lets readers keep going
+        while a bulk insert is in progress.
+
+        Read results are cached (query_cache_entries, 0 to disable) until
+        the data changes, whether through this object or another process.
+
+        debug=True restores the old per-insert logging and read-back check.
+        """
         self.db_name = db_name
+        self.debug = debug
+
+        self._write_lock = threading.RLock()
+        self._conn = self._connect()
+        # Bumped after every commit made through this object
+        self._write_generation = 0
+
+        # An in-memory database only exists on its own connection
+        self._shared_reads = db_name == ':memory:'
+        self._readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(read_pool_size)
+        self._all_readers = []
+
+        # PRAGMA data_version on a connection that never writes changes with
+        # every commit from any other connection, ours included
+        self._watch_lock = threading.Lock()
+        self._watch_conn = None if self._shared_reads else self._connect()
+        self.query_cache = QueryCache(query_cache_entries) if query_cache_entries else None
+
         self.init_database()
-    
+
+    def _connect(self):
+        """Open a connection configured for concurrent use"""
+        conn = sqlite3.connect(self.db_name, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints and is still crash-safe
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Needed for receipt_items' ON DELETE CASCADE (off by default in SQLite)
+        conn.execute("PRAGMA foreign_keys=ON")
+        # Used by the migrations that backfill date_iso and compress the OCR text
+        conn.create_function("iso_date", 1, normalize_date, deterministic=True)
+        conn.create_function("compress_text", 1, _compress_text, deterministic=True)
+        return conn
+
+    @contextmanager
+    def _writer(self):
+        """Writer connection inside a transaction (commit on success, rollback on error)"""
+        with self._write_lock:
+            with self._conn:
+                yield self._conn
+            self._write_generation += 1
+
+    def _data_state(self):
+        """Token that changes whenever the database contents may have changed"""
+        if self._watch_conn is None:
+            return (self._write_generation, 0)
+        with self._watch_lock:
+            data_version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+        return (self._write_generation, data_version)
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a reader connection from the pool"""
+        if self._shared_reads:
+            with self._write_lock:
+                yield self._conn
+            return
+
+        with self._reader_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                self._all_readers.append(conn)
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+
+    def close(self):
+        """Close all connections"""
+        with self._write_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._readers = queue.LifoQueue()
+            if self._watch_conn is not None:
+                self._watch_conn.close()
+            self._conn.close()
+
     def init_database(self):
         """Initialize database and create tables if they don't exist"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Create receipts table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS receipts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+        with self._writer() as conn:
+            # Create receipts table
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS receipts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    store_name TEXT,
+                    date TEXT,
+                    subtotal REAL,
+                    tax REAL,
+                    total REAL,
+                    transaction_id TEXT,
+                    image_path TEXT,
+                    created_at TEXT,
+                    raw_ocr_text TEXT
+                )
+            ''')
+
+            self._migrate(conn)
+
+    def _migrate(self, conn):
+        """Bring an existing database up to SCHEMA_VERSION, one step at a time"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        if version < 1:
+            self._create_summary_tables(conn)
+
+        if version < 2:
+            self._add_date_iso_column(conn)
+
+        if version < 4:
+            self._create_items_table(conn)
+
+        if version < 5:
+            self._add_parser_version_column(conn)
+
+        if version < 6:
+            self._move_ocr_text_to_blobs(conn)
+
+        if version < 7:
+            self._create_daily_summary_table(conn)
+
+        if version < 9:
+            self._add_edited_fields_column(conn)
+
+        if version < 13:
+            self._create_search_index(conn)
+
+        if version < 11:
+            self._add_ocr_partial_column(conn)
+
+        if version < SCHEMA_VERSION:
+            # Triggers always follow the current code, so recreate them
+            self._create_triggers(conn)
+
+        if version < 7:
+            self._rebuild_summaries(conn)
+
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _add_date_iso_column(self, conn):
+        """
+        Add a normalized ISO-8601 date column ('' when the date text can't be
+        parsed), backfill it from the date text and index it
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(receipts)")]
+        if 'date_iso' not in columns:
+            conn.execute("ALTER TABLE receipts ADD COLUMN date_iso TEXT NOT NULL DEFAULT ''")
+        conn.execute("UPDATE receipts SET date_iso = IFNULL(iso_date(date), '')")
+
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_date_iso ON receipts (date_iso)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_store_date ON receipts (store_name, date_iso)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_transaction_id ON receipts (transaction_id)")
+
+    def _add_parser_version_column(self, conn):
+        """
+        Record which parser version produced each row. Existing rows get 0
+        (unknown), so the first re-parse covers all of them.
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(receipts)")]
+        if 'parser_version' not in columns:
+            conn.execute("ALTER TABLE receipts ADD COLUMN parser_version INTEGER NOT NULL DEFAULT 0")
+
+    def _add_edited_fields_column(self, conn):
+        """
+        Record which parsed fields were corrected by hand (comma-separated
+        PARSED_FIELDS names), so re-parsing never overwrites them
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(receipts)")]
+        if 'edited_fields' not in columns:
+            conn.execute("ALTER TABLE receipts ADD COLUMN edited_fields TEXT NOT NULL DEFAULT ''")
+
+    def _add_ocr_partial_column(self, conn):
+        """
+        Flag receipts whose OCR text only covers part of the image (the
+        'totals' layout skips the line items), so they can be found and
+        OCR'd again in full
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(receipts)")]
+        if 'ocr_partial' not in columns:
+            conn.execute("ALTER TABLE receipts ADD COLUMN ocr_partial INTEGER NOT NULL DEFAULT 0")
+
+    def _move_ocr_text_to_blobs(self, conn):
+        """
+        Move raw_ocr_text out of receipts into zlib-compressed rows of
+        receipt_blobs, so scans of receipts only page through the narrow
+        numeric/text columns
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_blobs (
+                receipt_id INTEGER NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+                name TEXT NOT NULL,
+                data BLOB,
+                PRIMARY KEY (receipt_id, name)
+            )
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(receipts)")]
+        if 'raw_ocr_text' in columns:
+            moved = conn.execute('''
+                INSERT OR IGNORE INTO receipt_blobs (receipt_id, name, data)
+                SELECT id, 'raw_ocr_text', compress_text(raw_ocr_text)
+                FROM receipts
+                WHERE raw_ocr_text IS NOT NULL
+            ''').rowcount
+            # The old search index reads receipts.raw_ocr_text, and SQLite
+            # won't drop a column that triggers still use
+            conn.execute("DROP TRIGGER IF EXISTS receipts_fts_delete")
+            conn.execute("DROP TRIGGER IF EXISTS receipts_fts_update")
+            conn.execute("DROP TABLE IF EXISTS receipts_fts")
+            if sqlite3.sqlite_version_info >= (3, 35, 0):
+                conn.execute("ALTER TABLE receipts DROP COLUMN raw_ocr_text")
+            else:
+                # No DROP COLUMN before SQLite 3.35: leave the column empty
+                conn.execute("UPDATE receipts SET raw_ocr_text = NULL")
+            if moved:
+                # Not vacuumed here: rewriting a big file would hold up startup,
+                # and the freed pages are reused by new rows meanwhile
+                print(f"[INFO] Moved the OCR text of {moved} receipt(s) out of the receipts table; "
+                      f"run 'python manage.py vacuum' to return the freed space to the filesystem")
+
+    def _create_search_index(self, conn):
+        """
+        (Re)build the full-text index over the OCR text (rowid = receipt id).
+        It is contentless: only the index is stored, the text itself stays
+        compressed in receipt_blobs and snippets are built from there.
+        add_receipts indexes new text and receipt_blobs_fts_delete drops it.
+        """
+        # Earlier versions read the text through a view calling a Python
+        # function, then kept a second, uncompressed copy of it
+        conn.execute("DROP TABLE IF EXISTS receipts_fts")
+        conn.execute("DROP VIEW IF EXISTS receipt_ocr_text")
+        options = ", contentless_delete=1" if FTS_CONTENTLESS_DELETE else ""
+        conn.execute(f"CREATE VIRTUAL TABLE receipts_fts USING fts5(raw_ocr_text, content=''{options})")
+        blobs = conn.execute("SELECT receipt_id, data FROM receipt_blobs WHERE name = ? AND data IS NOT NULL",
+                             (OCR_TEXT_BLOB,))
+        conn.executemany("INSERT INTO receipts_fts (rowid, raw_ocr_text) VALUES (?, ?)",
+                         ((receipt_id, _decompress_text(data)) for receipt_id, data in blobs))
+
+    @staticmethod
+    def _fts_deletes_by_rowid(conn):
+        """Whether receipts_fts was created with contentless_delete"""
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'receipts_fts'").fetchone()
+        return bool(row) and 'contentless_delete' in row[0]
+
+    def _create_items_table(self, conn):
+        """
+        Line items of each receipt, indexed for per-product queries. Receipts
+        saved before this table existed have no items until they are re-parsed.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_items (
+                id INTEGER PRIMARY KEY,
+                receipt_id INTEGER NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+                line_no INTEGER NOT NULL,
+                description TEXT,
+                item_code TEXT,
+                quantity REAL NOT NULL DEFAULT 1,
+                price REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_receipt_items_receipt_id ON receipt_items (receipt_id)")
+        # Covers the per-product aggregates, so they never touch the table rows
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_receipt_items_item_code
+            ON receipt_items (item_code, quantity, price)
+        ''')
+
+    def _create_summary_tables(self, conn):
+        """Per-store and per-month totals, kept current by triggers on receipts"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS store_summary (
+                store_name TEXT PRIMARY KEY,
+                num_receipts INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0,
+                total_tax REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS monthly_summary (
+                month TEXT,
                 store_name TEXT,
-                date TEXT,
-                subtotal REAL,
-                tax REAL,
-                total REAL,
-                transaction_id TEXT,
-                image_path TEXT,
-                created_at TEXT,
-                raw_ocr_text TEXT
+                num_receipts INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0,
+                total_tax REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, store_name)
             )
         ''')
-        
-        conn.commit()
-        conn.close()
-    
-    def add_receipt(self, store_name, date, subtotal, tax, total, 
-                    transaction_id=None, image_path=None, raw_ocr_text=None):
-        """Add a new receipt to the database"""
+
+    def _create_daily_summary_table(self, conn):
+        """Per-day totals (day is date_iso), the base of the time-series analytics"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_summary (
+                day TEXT,
+                store_name TEXT,
+                num_receipts INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0,
+                total_tax REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, store_name)
+            )
+        ''')
+
+    def _create_triggers(self, conn):
+        """(Re)create the triggers that keep the summary tables and the search index current"""
+        triggers = {
+            'receipts_summary_insert': ("AFTER INSERT ON receipts",
+                                        _summary_add_sql('NEW')),
+            'receipts_summary_delete': ("AFTER DELETE ON receipts",
+                                        _summary_remove_sql('OLD')),
+            'receipts_summary_update': ("AFTER UPDATE OF store_name, date_iso, total, tax ON receipts",
+                                        _summary_remove_sql('OLD') + _summary_add_sql('NEW')),
+        }
+        if self._fts_deletes_by_rowid(conn):
+            # Also fires for the blobs removed by ON DELETE CASCADE
+            triggers['receipt_blobs_fts_delete'] = (
+                f"AFTER DELETE ON receipt_blobs WHEN OLD.name = '{OCR_TEXT_BLOB}'",
+                "DELETE FROM receipts_fts WHERE rowid = OLD.receipt_id;")
+        # Earlier versions indexed new OCR text from triggers on receipt_blobs,
+        # which decompressed every row through a Python function; without
+        # contentless_delete, delete_receipt removes index rows itself
+        for name in ('receipt_blobs_fts_insert', 'receipt_blobs_fts_update', 'receipt_blobs_fts_delete'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for name, (event, body) in triggers.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    def _rebuild_summaries(self, conn):
+        """Recompute the summary tables from the receipts table"""
+        conn.execute("DELETE FROM store_summary")
+        conn.execute("DELETE FROM monthly_summary")
+        conn.execute("DELETE FROM daily_summary")
+        conn.execute('''
+            INSERT INTO store_summary (store_name, num_receipts, total_spent, total_tax)
+            SELECT IFNULL(store_name, ''), COUNT(*), IFNULL(SUM(total), 0), IFNULL(SUM(tax), 0)
+            FROM receipts
+            GROUP BY IFNULL(store_name, '')
+        ''')
+        conn.execute('''
+            INSERT INTO monthly_summary (month, store_name, num_receipts, total_spent, total_tax)
+            SELECT substr(date_iso, 1, 7), IFNULL(store_name, ''),
+                   COUNT(*), IFNULL(SUM(total), 0), IFNULL(SUM(tax), 0)
+            FROM receipts
+            GROUP BY 1, 2
+        ''')
+        conn.execute('''
+            INSERT INTO daily_summary (day, store_name, num_receipts, total_spent, total_tax)
+            SELECT date_iso, IFNULL(store_name, ''),
+                   COUNT(*), IFNULL(SUM(total), 0), IFNULL(SUM(tax), 0)
+            FROM receipts
+            GROUP BY 1, 2
+        ''')
+
+    @metrics.timed('db.vacuum')
+    def vacuum(self):
+        """
+        Rewrite the database file to return free pages to the filesystem
+        Returns: (size before, size after) in bytes
+        """
+        with self._write_lock:
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            before = self._conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+            # VACUUM can't run inside a transaction, so not through _writer()
+            self._conn.execute("VACUUM")
+            after = self._conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+        return before, after
+
+    @metrics.timed('db.rebuild_summaries')
+    def rebuild_summaries(self):
+        """Recompute the spending summary tables from scratch"""
+        with self._writer() as conn:
+            self._rebuild_summaries(conn)
+
+    @metrics.timed('db.add_receipt')
+    def add_receipt(self, store_name, date, subtotal, tax, total,
+                    transaction_id=None, image_path=None, raw_ocr_text=None,
+                    items=None, parser_version=None, edited_fields=None, ocr_partial=False,
+                    verify=None):
+        """
+        Add a new receipt to the database
+        items: line items as returned by the parser (list of dicts)
+        parser_version: receipt_parser.PARSER_VERSION of the parser that read the text
+        edited_fields: PARSED_FIELDS names whose values were corrected by hand
+                       (kept as they are when the receipt is re-parsed)
+        ocr_partial: the OCR text skipped part of the receipt (see ReceiptOCR layouts)
+        verify: read the row back after saving (defaults to the debug setting)
+        """
+        if verify is None:
+            verify = self.debug
+
         try:
-            print(f"[DEBUG] Attempting to save receipt:")
-            print(f"  Store: {store_name}")
-            print(f"  Date: {date}")
-            print(f"  Total: {total}")
-            
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            cursor.execute('''
-                INSERT INTO receipts (store_name, date, subtotal, tax, total, 
-                                    transaction_id, image_path, created_at, raw_ocr_text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (store_name, date, subtotal, tax, total, transaction_id, 
-                  image_path, created_at, raw_ocr_text))
-            
-            receipt_id = cursor.lastrowid
-            conn.commit()
-            
-            print(f"[DEBUG] Receipt saved successfully with ID: {receipt_id}")
-            
-            # Verify it was actually saved
-            cursor.execute("SELECT COUNT(*) FROM receipts WHERE id = ?", (receipt_id,))
-            count = cursor.fetchone()[0]
-            print(f"[DEBUG] Verification - Receipt exists in DB: {count > 0}")
-            
-            conn.close()
-            
+            if self.debug:
+                print(f"[DEBUG] Attempting to save receipt:")
+                print(f"  Store: {store_name}")
+                print(f"  Date: {date}")
+                print(f"  Total: {total}")
+
+            receipt_ids = self.add_receipts([{
+                'store_name': store_name,
+                'date': date,
+                'subtotal': subtotal,
+                'tax': tax,
+                'total': total,
+                'transaction_id': transaction_id,
+                'image_path': image_path,
+                'raw_ocr_text': raw_ocr_text,
+                'items': items,
+                'parser_version': parser_version,
+                'edited_fields': edited_fields,
+                'ocr_partial': ocr_partial,
+            }])
+            receipt_id = receipt_ids[0]
+
+            if self.debug:
+                print(f"[DEBUG] Receipt saved successfully with ID: {receipt_id}")
+
+            if verify:
+                with self._reader() as conn:
+                    count = conn.execute("SELECT COUNT(*) FROM receipts WHERE id = ?",
+                                         (receipt_id,)).fetchone()[0]
+                print(f"[DEBUG] Verification - Receipt exists in DB: {count > 0}")
+
             return receipt_id
-            
+
         except Exception as e:
             print(f"[ERROR] Failed to save receipt: {str(e)}")
-            import traceback
-            traceback.print_exc()
             raise
-    
+
+    @metrics.timed('db.add_receipts')
+    def add_receipts(self, receipts):
+        """
+        Add many receipts and their line items in a single transaction
+        receipts: iterable of dicts with the same keys as add_receipt's arguments
+        Returns: list of new receipt IDs, in input order
+        """
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        receipts = list(receipts)
+        rows = [self._receipt_row(receipt, created_at) for receipt in receipts]
+        if not rows:
+            return []
+
+        placeholders = ', '.join('?' * len(INSERT_COLUMNS))
+        with self._writer() as conn:
+            conn.executemany(
+                f"INSERT INTO receipts ({', '.join(INSERT_COLUMNS)}) VALUES ({placeholders})",
+                rows
+            )
+            # We hold the write lock for the whole transaction, so the new
+            # AUTOINCREMENT ids are consecutive
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            receipt_ids = range(last_id - len(rows) + 1, last_id + 1)
+
+            texts = [(receipt_id, receipt.get('raw_ocr_text'))
+                     for receipt_id, receipt in zip(receipt_ids, receipts)
+                     if receipt.get('raw_ocr_text') is not None]
+            conn.executemany(
+                "INSERT INTO receipt_blobs (receipt_id, name, data) VALUES (?, ?, ?)",
+                ((receipt_id, OCR_TEXT_BLOB, _compress_text(text)) for receipt_id, text in texts)
+            )
+            # Indexed from the text we already hold (the index is contentless,
+            # so this stores no second copy)
+            conn.executemany("INSERT INTO receipts_fts (rowid, raw_ocr_text) VALUES (?, ?)", texts)
+
+            self._insert_items(conn, zip(receipt_ids, (receipt.get('items') for receipt in receipts)))
+
+        return list(receipt_ids)
+
+    @staticmethod
+    def _insert_items(conn, receipt_items):
+        """Insert line items; receipt_items yields (receipt_id, list of item dicts or None)"""
+        conn.executemany(
+            f"INSERT INTO receipt_items ({', '.join(ITEM_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (receipt_id, line_no, item.get('description'), item.get('item_code'),
+                 item.get('quantity') or 1, item.get('price'))
+                for receipt_id, items in receipt_items
+                for line_no, item in enumerate(items or (), 1)
+            )
+        )
+
+    @metrics.timed('db.count_stale_receipts')
+    def count_stale_receipts(self, parser_version):
+        """Count receipts parsed by a parser older than parser_version"""
+        with self._reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM receipts WHERE parser_version < ?",
+                                (parser_version,)).fetchone()[0]
+
+    def iter_stale_receipts(self, parser_version, chunk_size=1000):
+        """
+        Yield lists of (id, raw_ocr_text) for receipts parsed by an older
+        parser, in id order, chunk_size rows at a time. Each chunk is a
+        separate short query (keyset on id), so the table is never loaded
+        at once and no read transaction stays open between chunks.
+        """
+        query = '''
+            SELECT r.id, b.data
+            FROM receipts r
+            LEFT JOIN receipt_blobs b ON b.receipt_id = r.id AND b.name = ?
+            WHERE r.id > ? AND r.parser_version < ?
+            ORDER BY r.id
+            LIMIT ?
+        '''
+        last_id = 0
+        while True:
+            with self._reader() as conn:
+                chunk = conn.execute(query, (OCR_TEXT_BLOB, last_id, parser_version,
+                                             chunk_size)).fetchall()
+            if not chunk:
+                return
+            yield [(receipt_id, _decompress_text(data)) for receipt_id, data in chunk]
+            last_id = chunk[-1][0]
+
+    @metrics.timed('db.update_parsed_receipts')
+    def update_parsed_receipts(self, parsed_receipts, parser_version):
+        """
+        Store re-parsed results in one transaction
+        parsed_receipts: iterable of (receipt_id, parsed dict)
+        Header fields listed in a row's edited_fields (corrected by hand) and
+        fields the new parse could not find keep their saved value; line
+        items are replaced.
+        Only values that actually changed are written, so a parser upgrade
+        that leaves most receipts alone costs little more than the version stamp.
+        Receipts already re-parsed by a newer parser are left alone.
+        Returns: number of receipts updated
+        """
+        parsed_receipts = list(parsed_receipts)
+        if not parsed_receipts:
+            return 0
+
+        rows = []
+        for receipt_id, parsed in parsed_receipts:
+            values = {field: parsed.get(field) for field in PARSED_FIELDS}
+            values['date_iso'] = (normalize_date(values['date']) or '') if values['date'] else None
+            values.update(id=receipt_id, parser_version=parser_version)
+            rows.append(values)
+
+        # New value of each field: the saved one if it was edited (date_iso
+        # follows date) or the parse found nothing, else the parsed one
+        new_values = {
+            field: (f"CASE WHEN instr(',' || edited_fields || ',', ',{source},') > 0 "
+                    f"THEN {field} ELSE IFNULL(:{field}, {field}) END")
+            for field, source in zip(PARSED_FIELDS + ('date_iso',), PARSED_FIELDS + ('date',))
+        }
+        assignments = ', '.join(f"{field} = {value}" for field, value in new_values.items())
+        changed = ' OR '.join(f"{field} IS NOT {value}" for field, value in new_values.items())
+        ids = [receipt_id for receipt_id, _ in parsed_receipts]
+
+        with self._writer() as conn:
+            # Rows whose header changes (this fires the summary triggers)...
+            updated = conn.executemany(
+                f'''
+                UPDATE receipts SET {assignments}, parser_version = :parser_version
+                WHERE id = :id AND parser_version < :parser_version AND ({changed})
+                ''',
+                rows
+            ).rowcount
+            # ...and the version stamp for all the others
+            updated += conn.executemany(
+                "UPDATE receipts SET parser_version = :parser_version "
+                "WHERE id = :id AND parser_version < :parser_version",
+                rows
+            ).rowcount
+
+            # Current items of the receipts now stamped with this version.
+            # The write transaction is open, so a concurrent re-parse with a
+            # newer parser can't slip in; receipts it already took are left out.
+            current = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for receipt_id, line_no, *item in conn.execute(
+                    f'''
+                    SELECT r.id, i.line_no, i.description, i.item_code, i.quantity, i.price
+                    FROM receipts r
+                    LEFT JOIN receipt_items i ON i.receipt_id = r.id
+                    WHERE r.id IN ({', '.join('?' * len(chunk))}) AND r.parser_version = ?
+                    ORDER BY r.id, i.line_no
+                    ''',
+                    (*chunk, parser_version)
+                ):
+                    items = current.setdefault(receipt_id, [])
+                    if line_no is not None:
+                        items.append(tuple(item))
+
+            # Replace line items only where they differ
+            replaced = [
+                (receipt_id, parsed.get('items'))
+                for receipt_id, parsed in parsed_receipts
+                if receipt_id in current and current[receipt_id] != [
+                    (item.get('description'), item.get('item_code'),
+                     item.get('quantity') or 1, item.get('price'))
+                    for item in parsed.get('items') or ()
+                ]
+            ]
+            conn.executemany("DELETE FROM receipt_items WHERE receipt_id = ?",
+                             ((receipt_id,) for receipt_id, _ in replaced))
+            self._insert_items(conn, replaced)
+        return updated
+
+    @staticmethod
+    def _receipt_row(receipt, created_at):
+        """Build an INSERT_COLUMNS tuple from a receipt dict"""
+        values = dict(receipt)
+        values['date_iso'] = normalize_date(values.get('date')) or ''
+        if not values.get('created_at'):
+            values['created_at'] = created_at
+        values['parser_version'] = values.get('parser_version') or 0
+        values['edited_fields'] = ','.join(values.get('edited_fields') or ())
+        values['ocr_partial'] = int(bool(values.get('ocr_partial')))
+        return tuple(values.get(column) for column in INSERT_COLUMNS)
+
+    @metrics.timed('db.get_all_receipts')
+    @_cached_query
     def get_all_receipts(self):
         """Get all receipts as a pandas DataFrame"""
-        conn = sqlite3.connect(self.db_name)
-        df = pd.read_sql_query("SELECT * FROM receipts ORDER BY date DESC", conn)
-        conn.close()
+        with self._reader() as conn:
+            return pd.read_sql_query("SELECT * FROM receipts ORDER BY date_iso DESC, id DESC", conn)
+
+    def _receipt_filters(self, store_name=None, date_from=None, date_to=None):
+        """Build a WHERE clause and parameters for the common receipt filters"""
+        clauses = []
+        params = {}
+        if store_name is not None:
+            clauses.append("store_name = :store_name")
+            params['store_name'] = store_name
+        if date_from is not None:
+            clauses.append("date_iso >= :date_from")
+            params['date_from'] = str(date_from)
+        if date_to is not None:
+            clauses.append("date_iso <= :date_to")
+            params['date_to'] = str(date_to)
+        if date_from is not None or date_to is not None:
+            # Undated receipts store '', which sorts before every date
+            clauses.append("date_iso != ''")
+        return clauses, params
+
+    @metrics.timed('db.get_receipts_page')
+    @_cached_query
+    def get_receipts_page(self, page_size=50, cursor=None, sort_by='date', descending=True,
+                          store_name=None, date_from=None, date_to=None):
+        """
+        Get one page of receipts (display columns only) using keyset pagination
+        cursor: value returned with the previous page, None for the first page
+        date_from/date_to: inclusive ISO dates (YYYY-MM-DD) or date objects
+        Returns: (DataFrame, next_cursor); next_cursor is None on the last page
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort_by}")
+        sort_expr = SORT_KEYS[sort_by]
+        direction = 'DESC' if descending else 'ASC'
+
+        clauses, params = self._receipt_filters(store_name, date_from, date_to)
+        if cursor is not None:
+            # Row-value comparison continues right after the last row we returned
+            clauses.append(f"({sort_expr}, id) {'<' if descending else '>'} (:cursor_key, :cursor_id)")
+            params['cursor_key'], params['cursor_id'] = cursor
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        query = f'''
+            SELECT {', '.join(DISPLAY_COLUMNS)}, {sort_expr} AS sort_key
+            FROM receipts
+            {where}
+            ORDER BY sort_key {direction}, id {direction}
+            LIMIT :limit
+        '''
+        # Fetch one extra row to know whether another page follows
+        params['limit'] = page_size + 1
+
+        with self._reader() as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+
+        next_cursor = None
+        if len(df) > page_size:
+            df = df.iloc[:page_size]
+            # tolist() converts numpy scalars back to plain Python values
+            next_cursor = (df['sort_key'].tolist()[-1], df['id'].tolist()[-1])
+
+        return df.drop(columns='sort_key'), next_cursor
+
+    @metrics.timed('db.count_receipts')
+    @_cached_query
+    def count_receipts(self, store_name=None, date_from=None, date_to=None):
+        """Count receipts, using the summary table when no date filter is given"""
+        with self._reader() as conn:
+            if date_from is None and date_to is None:
+                if store_name is None:
+                    row = conn.execute("SELECT SUM(num_receipts) FROM store_summary").fetchone()
+                else:
+                    row = conn.execute("SELECT num_receipts FROM store_summary WHERE store_name = ?",
+                                       (store_name,)).fetchone()
+                return int(row[0]) if row and row[0] is not None else 0
+
+            clauses, params = self._receipt_filters(store_name, date_from, date_to)
+            query = f"SELECT COUNT(*) FROM receipts WHERE {' AND '.join(clauses)}"
+            return conn.execute(query, params).fetchone()[0]
+
+    @metrics.timed('db.get_receipts_between')
+    @_cached_query
+    def get_receipts_between(self, date_from, date_to, store_name=None):
+        """
+        Get receipts dated within [date_from, date_to] (ISO strings or date
+        objects), oldest first, as an index range scan on date_iso
+        """
+        clauses, params = self._receipt_filters(store_name, date_from, date_to)
+        query = f'''
+            SELECT {', '.join(DISPLAY_COLUMNS)}, date_iso
+            FROM receipts
+            WHERE {' AND '.join(clauses)}
+            ORDER BY date_iso, id
+        '''
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    @metrics.timed('db.get_spending_between')
+    @_cached_query
+    def get_spending_between(self, date_from, date_to, store_name=None):
+        """
+        Get receipt count, total spent and total tax for a date window
+        Returns: dict with num_receipts, total_spent, total_tax
+        """
+        clauses, params = self._receipt_filters(store_name, date_from, date_to)
+        query = f'''
+            SELECT COUNT(*), IFNULL(SUM(total), 0), IFNULL(SUM(tax), 0)
+            FROM receipts
+            WHERE {' AND '.join(clauses)}
+        '''
+        with self._reader() as conn:
+            num_receipts, total_spent, total_tax = conn.execute(query, params).fetchone()
+        return {
+            'num_receipts': num_receipts,
+            'total_spent': round(total_spent, 2),
+            'total_tax': round(total_tax, 2),
+        }
+
+    @metrics.timed('db.find_receipts_by_transaction_id')
+    @_cached_query
+    def find_receipts_by_transaction_id(self, transaction_id):
+        """Get receipts with the given transaction ID (uses its index)"""
+        query = f"SELECT {', '.join(DISPLAY_COLUMNS)} FROM receipts WHERE transaction_id = ?"
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn, params=(transaction_id,))
+
+    @metrics.timed('db.search_receipts')
+    @_cached_query
+    def search_receipts(self, query, limit=50, store_name=None, date_from=None, date_to=None):
+        """
+        Full-text search over the stored OCR text, best matches first (bm25)
+        query: words and "quoted phrases" that must all appear, e.g.
+               'great value milk' or '"GREAT VALUE" milk'
+        Returns: DataFrame of display columns plus a snippet of the match
+        """
+        match = fts_query(query)
+        if match is None:
+            return pd.DataFrame(columns=list(DISPLAY_COLUMNS) + ['snippet'])
+
+        clauses, params = self._receipt_filters(store_name, date_from, date_to)
+        clauses.insert(0, "receipts_fts MATCH :match")
+        params.update(match=match, limit=limit, blob=OCR_TEXT_BLOB)
+        columns = ', '.join(f"r.{column}" for column in DISPLAY_COLUMNS)
+
+        # Without contentless_delete, rows of receipts deleted by other tools
+        # can linger in the index; the join leaves them out
+        sql = f'''
+            SELECT {columns}, b.data
+            FROM receipts_fts
+            JOIN receipts r ON r.id = receipts_fts.rowid
+            LEFT JOIN receipt_blobs b ON b.receipt_id = r.id AND b.name = :blob
+            WHERE {' AND '.join(clauses)}
+            ORDER BY bm25(receipts_fts)
+            LIMIT :limit
+        '''
+        with self._reader() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        df['snippet'] = [search_snippet(_decompress_text(data), query) for data in df.pop('data')]
         return df
-    
+
+    @metrics.timed('db.get_raw_ocr_text')
+    @_cached_query
+    def get_raw_ocr_text(self, receipt_id):
+        """Get the OCR text saved with a receipt (None if there is none)"""
+        with self._reader() as conn:
+            row = conn.execute("SELECT data FROM receipt_blobs WHERE receipt_id = ? AND name = ?",
+                               (receipt_id, OCR_TEXT_BLOB)).fetchone()
+        return _decompress_text(row[0]) if row else None
+
+    @metrics.timed('db.get_receipt_items')
+    @_cached_query
+    def get_receipt_items(self, receipt_id):
+        """Get the line items of one receipt, in receipt order"""
+        query = '''
+            SELECT line_no, description, item_code, quantity, price
+            FROM receipt_items
+            WHERE receipt_id = ?
+            ORDER BY line_no
+        '''
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn, params=(receipt_id,))
+
+    @metrics.timed('db.get_product_spending')
+    @_cached_query
+    def get_product_spending(self, limit=50, store_name=None, date_from=None, date_to=None):
+        """
+        Get spending per product (item code), biggest spend first
+        Returns: DataFrame with item_code, description, num_purchases,
+        quantity, total_spent and avg_price
+        """
+        clauses, params = self._receipt_filters(store_name, date_from, date_to)
+        if clauses:
+            source = f"receipt_items JOIN receipts r ON r.id = receipt_items.receipt_id WHERE {' AND '.join(clauses)}"
+        else:
+            source = "receipt_items"
+        params['limit'] = limit
+
+        # Aggregate on the covering index first, then look up a description
+        # for the few products that made the cut
+        query = f'''
+            SELECT
+                item_code,
+                (SELECT description FROM receipt_items d
+                 WHERE d.item_code = products.item_code LIMIT 1) as description,
+                num_purchases,
+                quantity,
+                ROUND(total_spent, 2) as total_spent,
+                ROUND(total_spent / quantity, 2) as avg_price
+            FROM (
+                SELECT
+                    item_code,
+                    COUNT(*) as num_purchases,
+                    SUM(quantity) as quantity,
+                    SUM(price) as total_spent
+                FROM {source}
+                GROUP BY item_code
+                ORDER BY total_spent DESC
+                LIMIT :limit
+            ) products
+            ORDER BY total_spent DESC
+        '''
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    @metrics.timed('db.get_spending_summary')
+    @_cached_query
     def get_spending_summary(self):
-        """Get spending summary by store"""
-        conn = sqlite3.connect(self.db_name)
+        """Get spending summary by store (read from the precomputed summary table)"""
         query = '''
-            SELECT 
-                store_name,
-                COUNT(*) as num_receipts,
-                SUM(total) as total_spent,
-                SUM(tax) as total_tax,
-                AVG(total) as avg_spent
-            FROM receipts
-            GROUP BY store_name
+            SELECT
+                NULLIF(store_name, '') as store_name,
+                num_receipts,
+                ROUND(total_spent, 2) as total_spent,
+                ROUND(total_tax, 2) as total_tax,
+                total_spent / num_receipts as avg_spent
+            FROM store_summary
             ORDER BY total_spent DESC
         '''
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
-    
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn)
+
+    @metrics.timed('db.get_monthly_summary')
+    @_cached_query
+    def get_monthly_summary(self, store_name=None):
+        """
+        Get spending per month (YYYY-MM), optionally for a single store
+        Receipts whose date could not be parsed are left out
+        """
+        query = '''
+            SELECT
+                month,
+                SUM(num_receipts) as num_receipts,
+                ROUND(SUM(total_spent), 2) as total_spent,
+                ROUND(SUM(total_tax), 2) as total_tax
+            FROM monthly_summary
+            WHERE month != '' AND (:store IS NULL OR store_name = :store)
+            GROUP BY month
+            ORDER BY month
+        '''
+        with self._reader() as conn:
+            return pd.read_sql_query(query, conn, params={'store': store_name})
+
+    @metrics.timed('db.get_spending_timeseries')
+    @_cached_query
+    def get_spending_timeseries(self, freq='day', store_name=None, date_from=None, date_to=None,
+                                rolling=None):
+        """
+        Get spending per day, week or month from the daily summary table
+        freq: 'day', 'week' (starting Mondays) or 'month'
+        date_from/date_to: inclusive ISO dates (YYYY-MM-DD) or date objects
+        rolling: window, in periods, for a rolling average of total_spent
+        Receipts whose date could not be parsed are left out; periods with
+        no receipts in between are included with zero spend.
+        Returns: DataFrame indexed by period start with num_receipts,
+        total_spent, total_tax, avg_per_receipt (and rolling_avg_spent)
+        """
+        if freq not in TIMESERIES_FREQUENCIES:
+            raise ValueError(f"Unknown frequency: {freq}")
+
+        clauses = ["day != ''"]
+        params = {}
+        if store_name is not None:
+            clauses.append("store_name = :store_name")
+            params['store_name'] = store_name
+        if date_from is not None:
+            clauses.append("day >= :date_from")
+            params['date_from'] = str(date_from)
+        if date_to is not None:
+            clauses.append("day <= :date_to")
+            params['date_to'] = str(date_to)
+
+        # One row per day with data (at most a few thousand, whatever the
+        # number of receipts); the rollups below are vectorized pandas
+        query = f'''
+            SELECT
+                day,
+                SUM(num_receipts) as num_receipts,
+                SUM(total_spent) as total_spent,
+                SUM(total_tax) as total_tax
+            FROM daily_summary
+            WHERE {' AND '.join(clauses)}
+            GROUP BY day
+            ORDER BY day
+        '''
+        with self._reader() as conn:
+            df = pd.read_sql_query(query, conn, params=params, parse_dates=['day'], index_col='day')
+
+        df = df.resample(TIMESERIES_FREQUENCIES[freq], label='left', closed='left').sum()
+        df.index.name = 'period'
+        df['avg_per_receipt'] = (df['total_spent'] / df['num_receipts']).where(df['num_receipts'] > 0)
+        if rolling:
+            df['rolling_avg_spent'] = df['total_spent'].rolling(rolling, min_periods=1).mean()
+        return df.round(2)
+
+    @metrics.timed('db.delete_receipt')
     def delete_receipt(self, receipt_id):
         """Delete a receipt by ID"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        with self._writer() as conn:
+            if not self._fts_deletes_by_rowid(conn):
+                # A contentless index without contentless_delete is told
+                # which text to remove
+                row = conn.execute("SELECT data FROM receipt_blobs WHERE receipt_id = ? AND name = ?",
+                                   (receipt_id, OCR_TEXT_BLOB)).fetchone()
+                if row and row[0] is not None:
+                    conn.execute("INSERT INTO receipts_fts (receipts_fts, rowid, raw_ocr_text) "
+                                 "VALUES ('delete', ?, ?)", (receipt_id, _decompress_text(row[0])))
+            # Blobs and line items go with it (ON DELETE CASCADE), and the
+            # blob delete trigger (if any) drops it from the search index
+            conn.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
@@ -0,0 +1,557 @@
+"""
+Local HTTP service for receipt ingestion
+
+A small asyncio HTTP/1.1 server (standard library only) so scanners and
+other services can submit receipt images without going through the
+Streamlit app.
+
+Endpoints:
+    POST /receipts   raw image bytes as the body; returns the parsed receipt
+                     as JSON and saves it (query: name=<file name>,
+                     save=0 to only parse, allow_incomplete=1 to also save
+                     receipts missing store name, date or total)
+    GET  /health     liveness and current load
+    GET  /metrics    Prometheus text format (?format=json for JSON)
+
+OCR runs in a bounded process pool. Once workers + max queue uploads are
+in flight, new uploads get 429 with a Retry-After estimate (before their
+body is read, when the client sent Expect: 100-continue). Bodies are read
+before an upload takes an OCR slot, at most max uploads at a time, and
+every read has a timeout (408), so slow clients can't hold the workers.
+Parsed receipts are saved by a single writer task that groups concurrent
+requests into one add_receipts call.
+
+Usage:
+    python ingest_server.py --port 8080 --workers 4 --max-queue 16
+    curl --data-binary @receipt.jpg "http://127.0.0.1:8080/receipts?name=receipt.jpg"
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from database import ReceiptDatabase
+from instrumentation import metrics
+from ocr_processor import LAYOUTS
+from processing_queue import init_worker, process_image, tile_workers_for
+from receipt_parser import PARSER_VERSION, ReceiptParser
+
+REASONS = {
+    100: 'Continue', 200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 408: 'Request Timeout', 411: 'Length Required',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity', 429: 'Too Many Requests', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+# Largest request line + headers accepted
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or REASONS[status])
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.body = b''
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def flag(self, name, default):
+        value = self.query.get(name)
+        if value is None:
+            return default
+        return value.lower() not in ('0', 'false', 'no', '')
+
+
+async def read_request(reader, timeout=None):
+    """
+    Read a request line and headers (the body is left in the stream)
+    timeout: seconds to wait for the whole head (HTTPError 408 after that)
+    Returns: Request, or None when the client closed the connection
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPError(408, "timed out reading the request")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HTTPError(400, "incomplete request")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431)
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    return Request(method, target, version, headers)
+
+
+def format_response(status, body=b'', content_type='application/json', headers=None,
+                    keep_alive=True):
+    """Serialize a full HTTP/1.1 response"""
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+    elif isinstance(body, str):
+        body = body.encode()
+
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class ReceiptWriter:
+    """
+    Saves parsed receipts in batches from one background task
+    Requests arriving while a batch is being written are grouped into the
+    next one, so the database sees one transaction per batch rather than
+    one per upload.
+    """
+    def __init__(self, db, batch_size=50, max_delay=0.02):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.saved = 0
+        self.batches = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def save(self, receipt):
+        """Queue a receipt dict for add_receipts and wait for its ID"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((receipt, future))
+        return await future
+
+    async def close(self):
+        """Write whatever is queued, then stop"""
+        await self._queue.join()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent requests a moment to join this batch
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                with metrics.span('service.db_write'):
+                    receipt_ids = await asyncio.to_thread(
+                        self.db.add_receipts, [receipt for receipt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                self.saved += len(batch)
+                self.batches += 1
+                for (_, future), receipt_id in zip(batch, receipt_ids):
+                    if not future.done():
+                        future.set_result(receipt_id)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class IngestServer:
+    def __init__(self, db, workers=None, max_queue=None, max_upload_bytes=20 * 1024 * 1024,
+                 batch_size=50, layout=None, max_uploads=None, read_timeout=30,
+                 drain_timeout=30):
+        self.db = db
+        self.workers = workers or os.cpu_count() or 1
+        # Uploads allowed to wait for a free worker before new ones get 429
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        # Request bodies being received at once (they don't hold OCR slots yet)
+        self.max_uploads = self.capacity if max_uploads is None else max_uploads
+        self.max_upload_bytes = max_upload_bytes
+        self.read_timeout = read_timeout
+        self.drain_timeout = drain_timeout
+        self.layout = layout
+        self.parser = ReceiptParser()
+        self.writer = ReceiptWriter(db, batch_size=batch_size)
+
+        self.in_flight = 0
+        self.uploading = 0
+        self.started_at = time.time()
+        self.counters = {'requests': 0, 'rejected': 0, 'processed': 0, 'failed': 0,
+                         'timeouts': 0, 'pool_restarts': 0}
+        self.responses = {}
+        # Moving average of pool time per image, used for Retry-After
+        self._ocr_seconds = None
+        self._pool = None
+        self._listener = None
+        # Connection handler tasks, and the ones in the middle of a request
+        self._handlers = set()
+        self._busy = set()
+        self._closing = False
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def _new_pool(self):
+        # spawn: forking a process that already runs threads is not safe
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(False, self.layout, tile_workers_for(self.workers)),
+        )
+
+    async def start(self, host, port):
+        self._pool = self._new_pool()
+        # Start every worker now rather than on the first uploads
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, os.getpid)
+                               for _ in range(self.workers)))
+        self.writer.start()
+        self._listener = await asyncio.start_server(self.handle_connection, host, port,
+                                                    limit=MAX_HEADER_BYTES)
+        return self._listener
+
+    async def close(self):
+        """
+        Stop accepting connections, let requests in progress finish (up to
+        drain_timeout), then flush the writer and stop the pool
+        """
+        self._closing = True
+        if self._listener is not None:
+            self._listener.close()
+        # Idle keep-alive connections have nothing to finish
+        for task in self._handlers - self._busy:
+            task.cancel()
+        if self._handlers:
+            _, pending = await asyncio.wait(self._handlers, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        await self.writer.close()
+        if self._pool is not None:
+            # Joining the worker processes blocks, so not on the event loop
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while not self._closing:
+                try:
+                    request = await read_request(reader, self.read_timeout)
+                    if request is None:
+                        break
+                    self._busy.add(task)
+                    keep_alive = request.keep_alive and not self._closing
+                    response, keep_alive = await self.dispatch(request, reader, writer, keep_alive)
+                except HTTPError as e:
+                    keep_alive = False
+                    if e.status == 408:
+                        self.counters['timeouts'] += 1
+                    response = self.error(e.status, str(e), keep_alive=False)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    keep_alive = False
+                    response = self.error(500, f"{type(e).__name__}: {e}", keep_alive=False)
+                writer.write(response)
+                await writer.drain()
+                self._busy.discard(task)
+                if not keep_alive or self._closing:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(task)
+            self._busy.discard(task)
+            writer.close()
+
+    def error(self, status, message, headers=None, keep_alive=True):
+        self.responses[status] = self.responses.get(status, 0) + 1
+        return format_response(status, {'error': message}, headers=headers, keep_alive=keep_alive)
+
+    def ok(self, body, content_type='application/json', keep_alive=True):
+        self.responses[200] = self.responses.get(200, 0) + 1
+        return format_response(200, body, content_type=content_type, keep_alive=keep_alive)
+
+    async def dispatch(self, request, reader, writer, keep_alive):
+        """
+        Route one request
+        Returns: (response bytes, whether the connection stays open)
+        """
+        self.counters['requests'] += 1
+        routes = {'/receipts': ('POST',), '/health': ('GET',), '/metrics': ('GET',)}
+        if request.path not in routes:
+            return self.error(404, f"no such endpoint: {request.path}", keep_alive=keep_alive), keep_alive
+        if request.method not in routes[request.path]:
+            return self.error(405, f"{request.method} not allowed",
+                              headers={'Allow': ', '.join(routes[request.path])},
+                              keep_alive=keep_alive), keep_alive
+
+        if request.path == '/health':
+            return self.ok(self.health(), keep_alive=keep_alive), keep_alive
+        if request.path == '/metrics':
+            if request.query.get('format') == 'json':
+                return self.ok(self.metrics_json(), keep_alive=keep_alive), keep_alive
+            return self.ok(self.metrics_text(), content_type='text/plain; version=0.0.4',
+                           keep_alive=keep_alive), keep_alive
+
+        with metrics.span('service.request'):
+            return await self.post_receipt(request, reader, writer, keep_alive)
+
+    async def post_receipt(self, request, reader, writer, keep_alive):
+        """Run OCR + parsing for one upload and save the result"""
+        length = request.headers.get('content-length')
+        if length is None or not length.isdigit():
+            # No chunked uploads; whatever follows can't be framed, so close
+            return self.error(411, "Content-Length required", keep_alive=False), False
+        length = int(length)
+        if length > self.max_upload_bytes:
+            return self.error(413, f"upload larger than {self.max_upload_bytes} bytes",
+                              keep_alive=False), False
+        if length == 0:
+            return self.error(400, "empty upload", keep_alive=keep_alive), keep_alive
+
+        # Backpressure: refuse before reading the body. An unread body
+        # can't be skipped reliably, so those connections are closed.
+        if self.in_flight >= self.capacity or self.uploading >= self.max_uploads:
+            return self.reject(keep_alive=False), False
+
+        # The body is read before the upload counts against OCR capacity,
+        # so a slow client only ties up an upload slot
+        self.uploading += 1
+        try:
+            if request.headers.get('expect', '').lower() == '100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                await writer.drain()
+            request.body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, "timed out reading the upload")
+        finally:
+            self.uploading -= 1
+
+        # Capacity may have filled up while the body arrived; it has been
+        # read in full, so this connection can stay open
+        if self.in_flight >= self.capacity:
+            return self.reject(keep_alive=keep_alive), keep_alive
+
+        self.in_flight += 1
+        pool = self._pool
+        try:
+            name = request.query.get('name') or 'upload'
+            start = time.perf_counter()
+            with metrics.span('service.ocr'):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    pool, process_image, request.body, name)
+            self._observe_ocr(time.perf_counter() - start)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); every pending job on
+            # this pool fails with it, so replace the pool once
+            self._restart_pool(pool)
+            return self.error(503, "OCR worker crashed, retry later",
+                              headers={'Retry-After': self.retry_after()},
+                              keep_alive=keep_alive), keep_alive
+        finally:
+            self.in_flight -= 1
+
+        if result['error']:
+            self.counters['failed'] += 1
+            return self.error(422, result['error'], keep_alive=keep_alive), keep_alive
+        self.counters['processed'] += 1
+
+        parsed = result['parsed']
+        is_valid, missing = self.parser.validate_parsed_data(parsed)
+        receipt_id = None
+        if request.flag('save', True) and (is_valid or request.flag('allow_incomplete', False)):
+            receipt_id = await self.writer.save(dict(
+                parsed, image_path=name, raw_ocr_text=result['ocr_text'],
+                parser_version=PARSER_VERSION, ocr_partial=result['ocr_partial']))
+
+        # Shutting down: tell the client this connection ends here
+        keep_alive = keep_alive and not self._closing
+        return self.ok({
+            'id': receipt_id,
+            'name': name,
+            'saved': receipt_id is not None,
+            'valid': is_valid,
+            'missing_fields': missing,
+            'ocr_tier': result['ocr_tier'],
+            'ocr_confidence': result['ocr_confidence'],
+            'seconds': round(time.perf_counter() - start, 3),
+            'parsed': parsed,
+        }, keep_alive=keep_alive), keep_alive
+
+    def reject(self, keep_alive):
+        self.counters['rejected'] += 1
+        return self.error(429, "too many uploads in progress, retry later",
+                          headers={'Retry-After': self.retry_after()}, keep_alive=keep_alive)
+
+    def _restart_pool(self, broken):
+        if self._pool is not broken or self._closing:
+            return
+        self.counters['pool_restarts'] += 1
+        self._pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _observe_ocr(self, seconds):
+        if self._ocr_seconds is None:
+            self._ocr_seconds = seconds
+        else:
+            self._ocr_seconds = 0.8 * self._ocr_seconds + 0.2 * seconds
+
+    def retry_after(self):
+        """Seconds until a worker should be free, as a Retry-After value"""
+        per_image = self._ocr_seconds or 1.0
+        return str(max(1, math.ceil(per_image * self.in_flight / self.workers)))
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'capacity': self.capacity,
+            'uploading': self.uploading,
+            'pool_restarts': self.counters['pool_restarts'],
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+        }
+
+    def stats(self):
+        return dict(
+            self.counters,
+            in_flight=self.in_flight,
+            capacity=self.capacity,
+            uploading=self.uploading,
+            workers=self.workers,
+            saved=self.writer.saved,
+            write_batches=self.writer.batches,
+            avg_ocr_seconds=self._ocr_seconds,
+        )
+
+    def metrics_json(self):
+        return {
+            'service': self.stats(),
+            'responses': {str(status): count for status, count in sorted(self.responses.items())},
+            'spans': metrics.snapshot(),
+        }
+
+    def metrics_text(self):
+        """Service counters and gauges followed by the span histograms"""
+        lines = []
+        for name, value in self.stats().items():
+            if value is None:
+                continue
+            kind = ('gauge' if name in ('in_flight', 'capacity', 'uploading', 'workers', 'avg_ocr_seconds')
+                    else 'counter')
+            lines.append(f"# TYPE receipt_service_{name} {kind}")
+            lines.append(f"receipt_service_{name} {value}")
+        lines.append("# TYPE receipt_service_responses counter")
+        for status, count in sorted(self.responses.items()):
+            lines.append(f'receipt_service_responses{{status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n' + metrics.to_prometheus()
+
+
+async def serve(args):
+    server = IngestServer(
+        ReceiptDatabase(args.db),
+        workers=args.workers,
+        max_queue=args.max_queue,
+        max_upload_bytes=int(args.max_upload_mb * 1024 * 1024),
+        batch_size=args.batch_size,
+        layout=args.layout,
+        max_uploads=args.max_uploads,
+        read_timeout=args.read_timeout,
+        drain_timeout=args.drain_timeout,
+    )
+    listener = await server.start(args.host, args.port)
+    # SIGTERM shuts down like Ctrl+C: requests in progress finish and pending
+    # writes are flushed first (see IngestServer.close)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:  # Windows
+        pass
+    print(f"Listening on http://{args.host}:{args.port} with {server.workers} worker(s), "
+          f"up to {server.capacity} upload(s) in flight")
+    try:
+        await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service for receipt ingestion")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="Port (default: 8080)")
+    parser.add_argument('--db', default='receipts.db', help="Database file (default: receipts.db)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="OCR worker processes (default: CPU count)")
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help="Uploads that may wait for a worker before 429 (default: 4 per worker)")
+    parser.add_argument('--max-upload-mb', type=float, default=20,
+                        help="Largest accepted upload in MB (default: 20)")
+    parser.add_argument('--max-uploads', type=int, default=None,
+                        help="Request bodies received at once (default: workers + max queue)")
+    parser.add_argument('--read-timeout', type=float, default=30,
+                        help="Seconds allowed to receive request headers or a body (default: 30)")
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help="Seconds requests in progress get to finish on shutdown (default: 30)")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="Most receipts saved per database write (default: 50)")
+    parser.add_argument('--layout', choices=LAYOUTS, default=None,
+                        help="OCR layout (default: RECEIPT_OCR_LAYOUT or page)")
+    args = parser.parse_args(argv)
+
+    # Request and write timings are what /metrics is for
+    metrics.enable()
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
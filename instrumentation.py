@@ -0,0 +1,186 @@
+"""
+Lightweight timing instrumentation
+
+Spans around OCR stages, parser field extraction and database queries are
+aggregated into fixed-bucket histograms and can be exported as JSON or
+Prometheus text format.
+
+Turned off by default (enable with RECEIPT_METRICS=1 or metrics.enable()).
+When off, span() hands back a shared no-op context manager and timed()
+wrappers only check one attribute, so the cost is a function call.
+
+Usage:
+    from instrumentation import metrics
+
+    with metrics.span('ocr.tesseract'):
+        ...
+
+    @metrics.timed('db.get_spending_summary')
+    def get_spending_summary(self): ...
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+    """Cumulative-friendly histogram of durations"""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum_seconds': self.sum,
+            'mean_ms': self.sum / self.count * 1000 if self.count else None,
+            'p50_ms': self.quantile(0.5) * 1000 if self.count else None,
+            'p95_ms': self.quantile(0.95) * 1000 if self.count else None,
+            'min_ms': self.min * 1000 if self.count else None,
+            'max_ms': self.max * 1000 if self.count else None,
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(BUCKETS, self.counts)},
+        }
+
+
+class _NullSpan:
+    """No-op span returned while metrics are off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def span(self, name):
+        """Context manager timing the enclosed block"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of a function"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        """Record one duration (ignored while disabled)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Current histograms as plain dicts, keyed by span name"""
+        with self._lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self._histograms.items())}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (one histogram family, span as label)"""
+        family = 'receipt_span_duration_seconds'
+        lines = [
+            f"# HELP {family} Time spent in instrumented receipt pipeline spans",
+            f"# TYPE {family} histogram",
+        ]
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for name, histogram in items:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{family}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{family}_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'{family}_count{{span="{name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry used by the OCR, parser and database modules
+metrics = Metrics(enabled=os.environ.get('RECEIPT_METRICS') == '1')
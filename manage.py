@@ -0,0 +1,109 @@
+"""
+Maintenance commands for the receipts database
+
+Usage:
+    python manage.py rebuild-summaries [--db receipts.db]
+    python manage.py reparse [--chunk-size 2000] [--workers 4]
+    python manage.py vacuum
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import ReceiptDatabase
+from receipt_parser import PARSER_VERSION, ReceiptParser
+
+
+def rebuild_summaries(args):
+    db = ReceiptDatabase(args.db)
+    db.rebuild_summaries()
+    summary = db.get_spending_summary()
+    print(f"Rebuilt spending summaries: {len(summary)} store(s), "
+          f"{int(summary['num_receipts'].sum())} receipt(s)")
+    return 0
+
+
+def reparse(args):
+    """
+    Re-run the current parser over receipts saved by an older one
+    Rows are read, parsed and written back one chunk at a time, and each
+    chunk is its own short transaction, so the app keeps working meanwhile.
+    Updated rows are stamped with PARSER_VERSION: an interrupted run simply
+    continues with the rows that are still stale.
+    """
+    db = ReceiptDatabase(args.db)
+    parser = ReceiptParser()
+    workers = args.workers or os.cpu_count() or 1
+
+    stale = db.count_stale_receipts(PARSER_VERSION)
+    if not stale:
+        print(f"All receipts are up to date (parser version {PARSER_VERSION})")
+        return 0
+    print(f"Re-parsing {stale} receipt(s) to parser version {PARSER_VERSION} "
+          f"with {workers} worker(s)...")
+
+    # One pool for the whole run; parse_many parses small chunks in-process
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    start = time.perf_counter()
+    done = 0
+    try:
+        for chunk in db.iter_stale_receipts(PARSER_VERSION, chunk_size=args.chunk_size):
+            parsed = parser.parse_many((text or '' for _, text in chunk), workers=workers,
+                                       chunksize=max(1, len(chunk) // (workers * 4)), pool=pool)
+            done += db.update_parsed_receipts(
+                zip((receipt_id for receipt_id, _ in chunk), parsed), PARSER_VERSION
+            )
+            elapsed = time.perf_counter() - start
+            print(f"  {done}/{stale} re-parsed ({done / elapsed:.0f} receipts/sec)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print(f"Re-parsed {done} receipt(s) in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def vacuum(args):
+    """
+    Return free space to the filesystem (e.g. after the OCR text moved out
+    of the receipts table). Rewrites the whole file and blocks writers
+    while it runs, so run it when the app is quiet.
+    """
+    db = ReceiptDatabase(args.db)
+    start = time.perf_counter()
+    before, after = db.vacuum()
+    print(f"Vacuumed {args.db}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+          f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receipt database maintenance")
+    parser.add_argument('--db', default='receipts.db', help="Database file (default: receipts.db)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = commands.add_parser('rebuild-summaries',
+                                  help="Recompute the per-store and per-month summary tables")
+    rebuild.set_defaults(func=rebuild_summaries)
+
+    reparse_command = commands.add_parser('reparse',
+                                          help="Re-parse receipts saved by an older parser version")
+    reparse_command.add_argument('--chunk-size', type=int, default=2000,
+                                 help="Receipts read, parsed and saved per step (default: 2000)")
+    reparse_command.add_argument('--workers', type=int, default=None,
+                                 help="Parser processes (default: CPU count)")
+    reparse_command.set_defaults(func=reparse)
+
+    vacuum_command = commands.add_parser('vacuum',
+                                         help="Rewrite the database file to reclaim free space")
+    vacuum_command.set_defaults(func=vacuum)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+OCR engines behind ReceiptOCR
+
+Besides plain text, every backend can return per-word confidences
+(image_to_data), which the OCR cascade in ReceiptOCR uses to decide
+whether a cheap pass was good enough.
+
+- PytesseractBackend: the original path. Each call writes a temp image and
+  starts a new tesseract process (paying startup and model load every time).
+- TesseractPoolBackend: a pool of long-lived libtesseract engines (through
+  the optional tesserocr package). Pixels are handed over in memory and the
+  language model stays loaded between calls. tesserocr releases the GIL
+  while recognizing, so a thread pool can keep every engine busy.
+
+get_backend('auto') picks the pool when tesserocr is available and falls
+back to pytesseract otherwise.
+"""
+
+import os
+import queue
+import shlex
+import threading
+import warnings
+
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # optional dependency
+    tesserocr = None
+
+
+def parse_tesseract_config(config):
+    """
+    Split a tesseract command-line config string
+    Returns: (oem, psm, variables) with None for options not given
+    """
+    oem = psm = None
+    variables = {}
+    args = shlex.split(config or '')
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--oem' and i + 1 < len(args):
+            oem = int(args[i + 1])
+            i += 1
+        elif arg == '--psm' and i + 1 < len(args):
+            psm = int(args[i + 1])
+            i += 1
+        elif arg == '-c' and i + 1 < len(args):
+            name, _, value = args[i + 1].partition('=')
+            variables[name] = value
+            i += 1
+        i += 1
+    return oem, psm, variables
+
+
+class OCRBackend:
+    """Interface for OCR engines used by ReceiptOCR"""
+    name = 'base'
+
+    def image_to_string(self, image, config=''):
+        """OCR a grayscale/binary numpy image and return its text"""
+        raise NotImplementedError
+
+    def image_to_data(self, image, config=''):
+        """
+        OCR an image and report how sure the engine was
+        Returns: (text, list of word confidences from 0 to 100)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release engine resources"""
+        pass
+
+
+class PytesseractBackend(OCRBackend):
+    """One tesseract process per call through pytesseract"""
+    name = 'pytesseract'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, lang=self.lang, config=config)
+
+    def image_to_data(self, image, config=''):
+        # One tesseract run writes both the plain text (laid out by tesseract
+        # itself, spacing and blank lines included) and the TSV word boxes,
+        # which are only read for their confidences
+        config = f"-c tessedit_create_txt=1 -c tessedit_create_tsv=1 {config}".strip()
+        with pytesseract.pytesseract.save(image) as (output_base, input_filename):
+            pytesseract.pytesseract.run_tesseract(input_filename, output_base, 'tsv',
+                                                  self.lang, config)
+            with open(f"{output_base}.txt", encoding='utf-8') as f:
+                text = f.read()
+            with open(f"{output_base}.tsv", encoding='utf-8') as f:
+                data = pytesseract.pytesseract.file_to_dict(f.read(), '\t', -1)
+
+        confidences = [float(confidence)
+                       for word, confidence in zip(data.get('text', ()), data.get('conf', ()))
+                       if word and word.strip() and float(confidence) >= 0]
+        return text, confidences
+
+
+class TesseractPoolBackend(OCRBackend):
+    """Pool of warm libtesseract engines (requires tesserocr)"""
+    name = 'tesserocr-pool'
+
+    def __init__(self, workers=None, lang='eng', oem=None, path=None):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+
+        self.workers = workers or os.cpu_count() or 1
+        self.lang = lang
+        self.oem = tesserocr.OEM.DEFAULT if oem is None else oem
+        self.path = path or os.environ.get('TESSDATA_PREFIX')
+
+        self._engines = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._all_engines = []
+        self._lock = threading.Lock()
+
+    def _new_engine(self):
+        kwargs = {'lang': self.lang, 'oem': self.oem}
+        if self.path:
+            kwargs['path'] = self.path
+        engine = tesserocr.PyTessBaseAPI(**kwargs)
+        with self._lock:
+            self._all_engines.append(engine)
+        return engine
+
+    def image_to_string(self, image, config=''):
+        return self._recognize(image, config)[0]
+
+    def image_to_data(self, image, config=''):
+        text, confidences = self._recognize(image, config, with_confidences=True)
+        return text, [float(confidence) for confidence in confidences]
+
+    def _recognize(self, image, config, with_confidences=False):
+        oem, psm, variables = parse_tesseract_config(config)
+        if oem is not None and oem != self.oem:
+            raise ValueError(f"engine pool was created for --oem {self.oem}, not {oem}")
+
+        image = np.ascontiguousarray(image)
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise ValueError("expected a single-channel uint8 image")
+        height, width = image.shape
+
+        with self._slots:
+            try:
+                engine = self._engines.get_nowait()
+            except queue.Empty:
+                engine = self._new_engine()
+            # Engines are shared by every config, so -c variables are put
+            # back to their previous values before the engine is returned
+            saved = {}
+            try:
+                engine.SetPageSegMode(tesserocr.PSM.SINGLE_BLOCK if psm is None else psm)
+                for name, value in variables.items():
+                    saved[name] = engine.GetVariableAsString(name)
+                    engine.SetVariable(name, value)
+                engine.SetImageBytes(image.tobytes(), width, height, 1, width)
+                text = engine.GetUTF8Text()
+                # Confidences come from the recognition GetUTF8Text just ran
+                return text, engine.AllWordConfidences() if with_confidences else None
+            finally:
+                engine.Clear()
+                for name, value in saved.items():
+                    if value is not None:
+                        engine.SetVariable(name, value)
+                self._engines.put(engine)
+
+    def close(self):
+        with self._lock:
+            for engine in self._all_engines:
+                engine.End()
+            self._all_engines = []
+        self._engines = queue.LifoQueue()
+
+
+def get_backend(name='auto', workers=None):
+    """
+    Create an OCR backend by name: 'auto', 'pool' or 'pytesseract'
+    'auto' uses the engine pool when tesserocr is installed and can load
+    its language data, otherwise pytesseract
+    """
+    if name == 'pytesseract':
+        return PytesseractBackend()
+    if name == 'pool':
+        return TesseractPoolBackend(workers=workers)
+    if name != 'auto':
+        raise ValueError(f"Unknown OCR backend: {name}")
+
+    if tesserocr is not None:
+        try:
+            backend = TesseractPoolBackend(workers=workers)
+            # Fail here rather than on the first receipt if tessdata is missing
+            backend._engines.put(backend._new_engine())
+            return backend
+        except Exception as e:
+            warnings.warn(f"tesserocr engine pool unavailable ({e}); using pytesseract",
+                          RuntimeWarning, stacklevel=2)
+    return PytesseractBackend()
@@ -1,63 +1,910 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-import pytesseract
-from PIL import Image
+from PIL import ExifTags, Image, ImageOps
 
-class ReceiptOCR:
+from instrumentation import metrics
+from ocr_backends import get_backend
+
+# Tesseract settings used by extract_text
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+
+# Bump when the preprocessing code changes so stale cache entries are not reused
+PREPROCESS_VERSION = 4
+
+# Preprocessing profiles. Every stage can be switched off, and images are
+# resampled first so cap-height text lands near target_text_height pixels
+# (about what Tesseract reads best, ~300 DPI) and never exceeds max_pixels,
+# which bounds the cost of the later stages regardless of upload size.
+# decode_max_pixels lets JPEG uploads be decoded at reduced size (see
+# load_image); it is kept well above max_pixels because the receipt may
+# only fill part of the photo.
+PREPROCESS_PROFILES = {
+    'default': {
+        'crop': True,
+        'crop_min_area': 0.05,
+        'crop_max_area': 0.9,
+        'resample': True,
+        'target_text_height': 32,
+        'max_upscale': 2.0,
+        'max_pixels': 4_000_000,
+        'decode_max_pixels': 16_000_000,
+        'denoise': True,
+        'denoise_strength': 10,
+        'denoise_template_window': 7,
+        'denoise_search_window': 21,
+        'clahe': True,
+        'clahe_clip_limit': 2.0,
+        'clahe_tile_grid': 8,
+        'threshold': True,
+        'threshold_block_size': 11,
+        'threshold_c': 2,
+        'morphology_kernel': 1,
+    },
+    # Clean scans: smaller working size and a much cheaper denoise
+    'fast': {
+        'crop': True,
+        'crop_min_area': 0.05,
+        'crop_max_area': 0.9,
+        'resample': True,
+        'target_text_height': 24,
+        'max_upscale': 1.5,
+        'max_pixels': 2_000_000,
+        'decode_max_pixels': 8_000_000,
+        'denoise': True,
+        'denoise_strength': 7,
+        'denoise_template_window': 5,
+        'denoise_search_window': 11,
+        'clahe': False,
+        'clahe_clip_limit': 2.0,
+        'clahe_tile_grid': 8,
+        'threshold': True,
+        'threshold_block_size': 11,
+        'threshold_c': 2,
+        'morphology_kernel': 1,
+    },
+    # Cheapest tier of the OCR cascade: crop and resample only, no
+    # denoise/contrast/threshold (clean scans read fine as plain grayscale)
+    'grayscale': {
+        'crop': True,
+        'crop_min_area': 0.05,
+        'crop_max_area': 0.9,
+        'resample': True,
+        'target_text_height': 32,
+        'max_upscale': 2.0,
+        'max_pixels': 4_000_000,
+        'decode_max_pixels': 16_000_000,
+        'denoise': False,
+        'denoise_strength': 10,
+        'denoise_template_window': 7,
+        'denoise_search_window': 21,
+        'clahe': False,
+        'clahe_clip_limit': 2.0,
+        'clahe_tile_grid': 8,
+        'threshold': False,
+        'threshold_block_size': 11,
+        'threshold_c': 2,
+        'morphology_kernel': 1,
+    },
+    # The original full-resolution pipeline
+    'full_resolution': {
+        'crop': False,
+        'crop_min_area': 0.05,
+        'crop_max_area': 0.9,
+        'resample': False,
+        'target_text_height': 32,
+        'max_upscale': 1.0,
+        'max_pixels': None,
+        'decode_max_pixels': None,
+        'denoise': True,
+        'denoise_strength': 10,
+        'denoise_template_window': 7,
+        'denoise_search_window': 21,
+        'clahe': True,
+        'clahe_clip_limit': 2.0,
+        'clahe_tile_grid': 8,
+        'threshold': True,
+        'threshold_block_size': 11,
+        'threshold_c': 2,
+        'morphology_kernel': 1,
+    },
+}
+
+# OCR cascade used by ReceiptOCR.read_receipt, cheapest tier first:
+# (tier name, preprocessing profile or None for the instance's own, tesseract config).
+# --psm 4 (single column of variable-size text) rescues receipts whose
+# layout confuses the default single-block mode.
+CASCADE_TIERS = (
+    ('grayscale', 'grayscale', TESSERACT_CONFIG),
+    ('full', None, TESSERACT_CONFIG),
+    ('full_psm4', None, r'--oem 3 --psm 4'),
+)
+
+# Mean word confidence (0-100) a tier needs for its text to be accepted
+MIN_WORD_CONFIDENCE = 70
+
+# Stages that only fix the receipt's geometry, and the profile settings they
+# depend on. Cascade tiers whose profiles agree on these settings share
+# the stages' output instead of cropping and resampling again.
+GEOMETRY_STAGES = ('grayscale', 'crop', 'resample')
+GEOMETRY_SETTINGS = ('crop', 'crop_min_area', 'crop_max_area', 'resample',
+                     'target_text_height', 'max_upscale', 'max_pixels')
+
+# How ReceiptOCR lays out its tesseract calls:
+# 'page'   - one pass over the whole receipt
+# 'tiles'  - text lines found with a projection profile are cut into tiles
+#            of up to tile_lines lines, OCR'd in parallel and joined top to bottom
+# 'totals' - like 'tiles', but only the header lines and the bottom tiles
+#            up to the SUBTOTAL line are read (line items are skipped, so
+#            receipts saved from it are flagged ocr_partial)
+LAYOUTS = ('page', 'tiles', 'totals')
+TILE_LINES = 12
+HEADER_LINES = 4
+
+# Bottom tiles are read until one contains this (the start of the totals block)
+SUBTOTAL_RULE = re.compile(r'SUB\s*-?\s*TOTAL', re.IGNORECASE)
+
+
+def find_text_lines(image, min_ink=0.003, margin=0.02):
+    """
+    Find text lines in a preprocessed receipt with a horizontal projection profile
+    - Dark pixels are counted per row (isolated specks are median-filtered
+      out, and the outer margin columns are skipped so leftover background
+      at the edges doesn't mark every row)
+    - Runs of rows above the noise floor (min_ink of the width, or twice
+      the emptiest rows' count) are line candidates
+    - Candidates are kept when their densest row reaches half the profile's
+      Otsu level and they are not much thinner than a typical line
+    Returns: list of (top, bottom) row ranges, top to bottom
+    """
+    height, width = image.shape[:2]
+    border = int(width * margin)
+    _, ink = cv2.threshold(image[:, border:width - border], 0, 1,
+                           cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ink = cv2.medianBlur(ink, 3)
+    rows = cv2.reduce(ink, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    if not rows.any():
+        return []
+
+    low = max(1, min_ink * ink.shape[1], 2 * np.percentile(rows, 10))
+    scale = 255.0 / rows.max()
+    level, _ = cv2.threshold((rows * scale).astype(np.uint8).reshape(-1, 1), 0, 255,
+                             cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    high = max(low, level / scale / 2)
+
+    # Runs of candidate rows: +1 where one starts, -1 just past where it ends
+    is_text = (rows >= low).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_text, [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if not len(starts):
+        return []
+    # Rows between runs are below low, so each reduceat slice peaks inside its run
+    keep = np.maximum.reduceat(rows, starts) >= high
+    heights = ends - starts
+    if keep.any():
+        keep &= heights >= max(3, 0.4 * np.median(heights[keep]))
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def tile_bounds(lines, start, stop, height):
+    """
+    Row range covering lines[start:stop], cut halfway into the gaps
+    around it (or at the image edge)
+    Returns: (top, bottom)
+    """
+    top = 0 if start == 0 else (lines[start - 1][1] + lines[start][0]) // 2
+    bottom = height if stop == len(lines) else (lines[stop - 1][1] + lines[stop][0]) // 2
+    return top, bottom
+
+
+def pil_to_gray(image):
+    """
+    Grayscale array from a PIL image of any mode
+    EXIF orientation is applied, and transparent areas (RGBA, LA, palette
+    with transparency) are flattened onto white paper instead of black.
+    Returns: 2D uint8 numpy array
+    """
+    if image.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        paper = Image.new('L', image.size, 255)
+        paper.paste(image.convert('L'), mask=image.getchannel('A'))
+        image = paper
+    elif image.mode != 'L':
+        image = image.convert('L')
+    return np.asarray(image)
+
+
+def load_image(source, max_pixels=None):
+    """
+    Decode an image file straight to grayscale
+    JPEGs are decoded as luma only, and when the photo has more than
+    max_pixels the decoder itself scales it down (by 1/2, 1/4 or 1/8, never
+    below max_pixels), so no full-size RGB copy is ever built.
+    source: file path, file object or the raw bytes of an upload
+    Returns: 2D uint8 numpy array
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as image:
+        width, height = image.size
+        if max_pixels and width * height > max_pixels:
+            factor = (width * height / max_pixels) ** 0.5
+            image.draft('L', (int(np.ceil(width / factor)), int(np.ceil(height / factor))))
+        else:
+            image.draft('L', image.size)
+        return pil_to_gray(image)
+
+
+class WorkBuffers(threading.local):
+    """
+    Scratch arrays reused by the preprocessing stages, one set per thread
+    Each stage reads one slot and writes the other, so a run allocates
+    nothing new once the slots have grown to the working size.
+    """
     def __init__(self):
+        self._slots = [np.empty(0, np.uint8), np.empty(0, np.uint8)]
+
+    def get(self, shape, source=None):
+        """uint8 array of the given shape in a slot not holding source"""
+        size = int(np.prod(shape))
+        for i, slot in enumerate(self._slots):
+            if source is not None and np.may_share_memory(slot, source):
+                continue
+            if slot.size < size:
+                slot = self._slots[i] = np.empty(size, np.uint8)
+            return slot[:size].reshape(shape)
+        raise ValueError("source overlaps every work buffer")
+
+    def detach(self, image):
+        """image itself, or a copy of it when it lives in a work buffer"""
+        if any(np.may_share_memory(slot, image) for slot in self._slots):
+            return image.copy()
+        return image
+
+
+def estimate_text_height(gray, sample_size=1000):
+    """
+    Estimate the typical character height (in pixels of gray) from the
+    connected components of a binarized thumbnail
+    Returns: median component height, or None if no text-like blobs are found
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, sample_size / max(height, width))
+    thumb = gray if scale == 1.0 else cv2.resize(
+        gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+        interpolation=cv2.INTER_AREA
+    )
+
+    _, ink = cv2.threshold(thumb, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+
+    # Keep character-sized blobs: not specks, not lines/borders/photos
+    max_height = thumb.shape[0] / 8
+    keep = (heights >= 3) & (heights <= max_height) & (widths <= heights * 4)
+    if keep.sum() < 10:
+        return None
+    return float(np.median(heights[keep])) / scale
+
+
+def find_receipt_quad(gray, sample_size=800):
+    """
+    Find the receipt (the largest bright paper region) in a photo
+    Works on a blurred thumbnail; the paper is separated from the background
+    with Otsu's threshold and closed up so the printed text doesn't break it.
+    Returns: 4x2 float32 corners (tl, tr, br, bl) in gray's pixel
+             coordinates, or None if nothing receipt-like was found
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, sample_size / max(height, width))
+    thumb = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+
+    blurred = cv2.GaussianBlur(thumb, (5, 5), 0)
+    _, paper = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+
+    # A clean four-corner outline gives a true perspective correction;
+    # otherwise fall back to the rotated bounding box (deskew only)
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    if len(approx) == 4 and cv2.isContourConvex(approx):
+        corners = approx.reshape(4, 2).astype(np.float32)
+    else:
+        corners = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
+
+    return _order_corners(corners / scale)
+
+
+def _order_corners(corners):
+    """Order four points as top-left, top-right, bottom-right, bottom-left"""
+    sums = corners.sum(axis=1)
+    diffs = np.diff(corners, axis=1).ravel()
+    return np.array([
+        corners[np.argmin(sums)],
+        corners[np.argmin(diffs)],
+        corners[np.argmax(sums)],
+        corners[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def quad_area(corners):
+    """Area of a quadrilateral given its ordered corners (shoelace formula)"""
+    x, y = corners[:, 0], corners[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+
+
+def read_only(array):
+    """Read-only view of an array (the array itself stays writable)"""
+    view = array.view()
+    view.setflags(write=False)
+    return view
+
+
+class OCRCache:
+    """
+    Content-addressed cache for preprocessed images and OCR text
+    - In-memory LRU bounded by total bytes
+    - Optional on-disk tier (PNG for images, .txt for text) that survives restarts
+    Cached images are shared by every caller, so get returns them read-only
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        return len(value)
+
+    def _disk_path(self, key, kind):
+        extension = '.png' if kind == 'image' else '.txt'
+        return os.path.join(self.cache_dir, key + extension)
+
+    def get(self, key, kind):
+        """Return the cached value or None"""
+        with self._lock:
+            value = self._entries.get((kind, key))
+            if value is not None:
+                self._entries.move_to_end((kind, key))
+                self.hits += 1
+                return value
+
+        value = self._load_from_disk(key, kind)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, kind, value)
+        return value
+
+    def put(self, key, kind, value):
+        """Store a value in memory and, if configured, on disk"""
+        if isinstance(value, np.ndarray):
+            # Cached arrays are shared between callers, so keep a read-only
+            # copy (the caller's array stays writable and theirs alone)
+            value = value.copy()
+            value.setflags(write=False)
+        self._remember(key, kind, value)
+
+        if self.cache_dir:
+            if kind == 'image':
+                data = cv2.imencode('.png', value)[1].tobytes()
+            else:
+                data = value.encode('utf-8')
+            self._write_to_disk(self._disk_path(key, kind), data)
+
+    def _write_to_disk(self, path, data):
+        """
+        Write a cache file atomically: readers (other workers sharing the
+        directory) see either no file or the complete one, never a partial write
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def clear(self):
+        """Drop all in-memory entries (the disk tier is left alone)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key, kind, value):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop((kind, key), None)
+            if old is not None:
+                self._size -= self._sizeof(old)
+
+            self._entries[(kind, key)] = value
+            self._size += size
+
+            # Evict least recently used entries until we fit again
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._sizeof(evicted)
+
+    def _load_from_disk(self, key, kind):
+        if not self.cache_dir:
+            return None
+
+        path = self._disk_path(key, kind)
+        if not os.path.exists(path):
+            return None
+
+        if kind == 'image':
+            value = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if value is not None:
+                value.setflags(write=False)
+            return value
+
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+
+
+class ReceiptOCR:
+    def __init__(self, profile='default', cache_bytes=256 * 1024 * 1024, cache_dir=None,
+                 backend='auto', cascade=CASCADE_TIERS, min_confidence=MIN_WORD_CONFIDENCE,
+                 layout='page', tile_lines=TILE_LINES, tile_workers=None):
         # You may need to set the tesseract path on Windows
         # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-        pass
+
+        # backend: name for ocr_backends.get_backend, or an OCRBackend instance
+        self.backend = get_backend(backend) if isinstance(backend, str) else backend
+
+        # profile: name from PREPROCESS_PROFILES, or a dict overriding 'default'
+        if isinstance(profile, str):
+            profile = PREPROCESS_PROFILES[profile]
+        self.profile = {**PREPROCESS_PROFILES['default'], **profile}
+        self.preprocess_config = f"v{PREPROCESS_VERSION}|{sorted(self.profile.items())}"
+        self.geometry_config = tuple(self.profile[key] for key in GEOMETRY_SETTINGS)
+
+        # Set cache_bytes=0 to disable caching
+        self.cache = OCRCache(cache_bytes, cache_dir) if cache_bytes else None
+
+        # cascade: tiers tried by read_receipt (see CASCADE_TIERS)
+        self.cascade = cascade
+        self.min_confidence = min_confidence
+        self._tier_pipelines = {}
+
+        self._buffers = WorkBuffers()
+
+        # layout: one of LAYOUTS; tiles are OCR'd on a thread pool (tesseract
+        # runs outside the GIL, in a subprocess or in tesserocr)
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown OCR layout: {layout}")
+        self.layout = layout
+        self.tile_lines = tile_lines
+        self.tile_workers = tile_workers or os.cpu_count() or 1
+        self._tile_pool = ThreadPoolExecutor(self.tile_workers) if layout != 'page' else None
+
+    def close(self):
+        """Stop the tile threads (the backend may be shared, so it is left open)"""
+        if self._tile_pool is not None:
+            self._tile_pool.shutdown(wait=True)
+            self._tile_pool = None
     
+    @staticmethod
+    def _to_array(image):
+        """Convert PIL Image to a grayscale numpy array if needed"""
+        if isinstance(image, Image.Image):
+            return pil_to_gray(image)
+        return image
+
+    def load_image(self, source):
+        """Decode an image file or upload bytes to grayscale (see load_image)"""
+        return load_image(source, self.profile['decode_max_pixels'])
+
+    @staticmethod
+    def image_digest(image):
+        """Hash of the image pixels, shape and dtype (the cache key base)"""
+        array = np.ascontiguousarray(image)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{array.shape}|{array.dtype}".encode())
+        digest.update(memoryview(array).cast('B'))
+        return digest.hexdigest()
+
+    def _cache_key(self, digest, config):
+        return hashlib.blake2b(f"{digest}|{config}".encode(), digest_size=20).hexdigest()
+
     def preprocess_image(self, image):
         """
         Preprocess the image for better OCR results
+        Results are cached by image content when caching is enabled. The
+        returned array is read-only either way (cached ones are shared);
+        copy it before changing it.
+        """
+        image = self._to_array(image)
+        if self.cache is None:
+            return read_only(self._preprocess(image))
+        return self._preprocess_cached(image, self.image_digest(image))
+
+    def _preprocess_cached(self, image, digest, prepared=None):
+        """Preprocess through the cache; read-only on a hit and on a miss alike"""
+        key = self._cache_key(digest, self.preprocess_config)
+        processed = self.cache.get(key, 'image')
+        if processed is None:
+            processed = self._preprocess(image, prepared=prepared)
+            self.cache.put(key, 'image', processed)
+            processed = read_only(processed)
+        return processed
+
+    def preprocess_stages(self):
+        """
+        Enabled preprocessing stages for the current profile, in order
+        Returns: list of (stage name, function taking and returning an image)
+        """
+        profile = self.profile
+        stages = [('grayscale', self._to_gray)]
+        # Keep only the receipt's pixels (perspective corrected and deskewed)
+        if profile['crop']:
+            stages.append(('crop', lambda gray: self.crop_to_receipt(gray)[0]))
+        # Resample before the expensive stages so their cost is bounded
+        if profile['resample']:
+            stages.append(('resample', self.resample))
+        if profile['denoise']:
+            stages.append(('denoise', self._denoise))
+        if profile['clahe']:
+            stages.append(('clahe', self._enhance_contrast))
+        if profile['threshold']:
+            stages.append(('threshold', self._binarize))
+        # A 1x1 kernel is a no-op, so only larger ones get a stage
+        if profile['morphology_kernel'] > 1:
+            stages.append(('morphology', self._close))
+        return stages
+
+    def _preprocess(self, image, timings=None, prepared=None):
+        """
+        Preprocessing pipeline (stages are set by the profile)
         - Convert to grayscale
+        - Crop to the receipt
+        - Resample to the working resolution
         - Denoise
         - Increase contrast
         - Binarization
+        timings: optional dict that receives seconds spent per stage
+        prepared: optional dict of geometry stage results by geometry_config,
+                  shared by calls on the same image; results found there are
+                  reused and new ones are added
         """
-        # Convert PIL Image to numpy array if needed
-        if isinstance(image, Image.Image):
-            image = np.array(image)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        
-        # Apply denoising
-        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-        
-        # Increase contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        contrast = clahe.apply(denoised)
-        
-        # Apply adaptive thresholding for binarization
-        binary = cv2.adaptiveThreshold(
-            contrast, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
+        stages = self.preprocess_stages()
+        geometry = [(name, stage) for name, stage in stages if name in GEOMETRY_STAGES]
+        if prepared is not None and self.geometry_config in prepared:
+            image = prepared[self.geometry_config]
+        else:
+            image = self._run_stages(geometry, image, timings)
+            if prepared is not None:
+                image = prepared[self.geometry_config] = self._buffers.detach(image)
+        image = self._run_stages(stages[len(geometry):], image, timings)
+        # The caller keeps the result, so it can't stay in a work buffer
+        return self._buffers.detach(image)
+
+    def _run_stages(self, stages, image, timings=None):
+        """Apply (name, function) stages in order, timing them when asked or enabled"""
+        measure = timings is not None or metrics.enabled
+        for name, stage in stages:
+            if not measure:
+                image = stage(image)
+                continue
+            start = time.perf_counter()
+            image = stage(image)
+            elapsed = time.perf_counter() - start
+            if timings is not None:
+                timings[name] = elapsed
+            metrics.observe(f'ocr.preprocess.{name}', elapsed)
+        return image
+
+    def _to_gray(self, image):
+        """Convert to grayscale (2D input already is; alpha is flattened onto white)"""
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 1:
+            return image[:, :, 0]
+        if image.shape[2] == 4:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+            alpha = np.ascontiguousarray(image[:, :, 3])
+            # gray * alpha + white * (1 - alpha)
+            return cv2.add(cv2.multiply(gray, alpha, scale=1 / 255), cv2.bitwise_not(alpha))
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    def _denoise(self, gray):
+        """Apply non-local means denoising"""
+        profile = self.profile
+        return cv2.fastNlMeansDenoising(
+            gray, self._buffers.get(gray.shape, gray), profile['denoise_strength'],
+            profile['denoise_template_window'], profile['denoise_search_window']
         )
-        
-        # Optional: Morphological operations to remove noise
-        kernel = np.ones((1, 1), np.uint8)
-        processed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        
-        return processed
-    
+
+    def _enhance_contrast(self, gray):
+        """Increase contrast using CLAHE (Contrast Limited Adaptive Histogram Equalization)"""
+        grid = self.profile['clahe_tile_grid']
+        clahe = cv2.createCLAHE(clipLimit=self.profile['clahe_clip_limit'], tileGridSize=(grid, grid))
+        return clahe.apply(gray, self._buffers.get(gray.shape, gray))
+
+    def _binarize(self, gray):
+        """Apply adaptive thresholding for binarization"""
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, self.profile['threshold_block_size'], self.profile['threshold_c'],
+            self._buffers.get(gray.shape, gray)
+        )
+
+    def _close(self, binary):
+        """Morphological closing to remove noise"""
+        size = self.profile['morphology_kernel']
+        kernel = np.ones((size, size), np.uint8)
+        return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel, self._buffers.get(binary.shape, binary))
+
+    def crop_to_receipt(self, gray):
+        """
+        Crop a grayscale photo to the receipt, correcting perspective and skew
+        Returns: (cropped image, fraction of the original area kept); the
+                 image is returned unchanged (fraction 1.0) when no receipt is
+                 found or it already fills the frame
+        """
+        corners = find_receipt_quad(gray)
+        if corners is None:
+            return gray, 1.0
+
+        height, width = gray.shape[:2]
+        area_ratio = quad_area(corners) / (height * width)
+        if not self.profile['crop_min_area'] <= area_ratio <= self.profile['crop_max_area']:
+            return gray, 1.0
+
+        tl, tr, br, bl = corners
+        out_width = int(round(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))))
+        out_height = int(round(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))))
+
+        # Nearly axis-aligned receipts only need a slice, not a warp
+        edge = tr - tl
+        if abs(np.degrees(np.arctan2(edge[1], edge[0]))) < 0.5:
+            x0, y0 = np.floor(corners.min(axis=0)).astype(int).clip(0)
+            x1, y1 = np.ceil(corners.max(axis=0)).astype(int)
+            return gray[y0:y1, x0:x1], area_ratio
+
+        target = np.array([[0, 0], [out_width - 1, 0], [out_width - 1, out_height - 1],
+                           [0, out_height - 1]], dtype=np.float32)
+        matrix = cv2.getPerspectiveTransform(corners, target)
+        warped = cv2.warpPerspective(gray, matrix, (out_width, out_height),
+                                     flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return warped, area_ratio
+
+    def working_scale(self, gray):
+        """
+        Scale factor that brings text to the profile's target height,
+        limited by max_upscale and max_pixels
+        """
+        profile = self.profile
+        scale = 1.0
+
+        text_height = estimate_text_height(gray)
+        if text_height:
+            scale = min(profile['target_text_height'] / text_height, profile['max_upscale'])
+
+        if profile['max_pixels']:
+            height, width = gray.shape[:2]
+            scale = min(scale, (profile['max_pixels'] / (height * width)) ** 0.5)
+
+        return scale
+
+    def resample(self, gray):
+        """Resize a grayscale image to the working resolution"""
+        scale = self.working_scale(gray)
+        # Not worth resampling (and blurring) for small changes
+        if 0.9 <= scale <= 1.1:
+            return gray
+
+        height, width = gray.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(gray, size, self._buffers.get(size[::-1], gray),
+                          interpolation=interpolation)
+
+    @metrics.timed('ocr.extract_text')
     def extract_text(self, image):
         """
         Extract text from receipt image
         Returns: raw OCR text
         """
-        # Preprocess the image
-        processed_image = self.preprocess_image(image)
-        
-        # Configure Tesseract
-        custom_config = r'--oem 3 --psm 6'
-        
-        # Perform OCR
-        text = pytesseract.image_to_string(processed_image, config=custom_config)
-        
+        image = self._to_array(image)
+        if self.cache is None:
+            return self._ocr(self._preprocess(image))
+
+        digest = self.image_digest(image)
+        key = self._cache_key(digest, '|'.join((self.preprocess_config, TESSERACT_CONFIG,
+                                                self.backend.name, self.layout_config)))
+        text = self.cache.get(key, 'text')
+        if text is None:
+            text = self._ocr(self._preprocess_cached(image, digest))
+            self.cache.put(key, 'text', text)
         return text
+
+    def _tier_pipeline(self, profile):
+        """ReceiptOCR doing one cascade tier's preprocessing (shares backend and cache)"""
+        if profile is None:
+            return self
+        pipeline = self._tier_pipelines.get(profile)
+        if pipeline is None:
+            pipeline = ReceiptOCR(profile, cache_bytes=0, backend=self.backend, cascade=())
+            pipeline.cache = self.cache
+            pipeline._buffers = self._buffers
+            self._tier_pipelines[profile] = pipeline
+        return pipeline
+
+    @metrics.timed('ocr.read_receipt')
+    def read_receipt(self, image, parser):
+        """
+        OCR and parse a receipt, escalating through the cascade tiers
+        A tier is accepted when parser.validate_parsed_data finds every
+        required field and the mean word confidence reaches min_confidence;
+        if none is, the most complete (then most confident) attempt wins.
+        Returns: dict with text, parsed data, tier (name of the tier used),
+                 confidence, accepted flag, the tiers tried and partial (True
+                 when the layout skipped the line items, see LAYOUTS)
+        """
+        image = self._to_array(image)
+        digest = self.image_digest(image) if self.cache is not None else None
+        processed = {}
+        # Cropped and resampled image by geometry settings, so later tiers
+        # only add their own denoise/contrast/threshold stages
+        prepared = {}
+        best = None
+        tried = []
+
+        for tier, profile, config in self.cascade:
+            start = time.perf_counter()
+            pipeline = self._tier_pipeline(profile)
+            # Tiers that only change the tesseract config reuse the preprocessing
+            if pipeline.preprocess_config not in processed:
+                processed[pipeline.preprocess_config] = (
+                    pipeline._preprocess(image, prepared=prepared) if digest is None
+                    else pipeline._preprocess_cached(image, digest, prepared))
+            text, confidence = self._ocr_with_confidence(
+                processed[pipeline.preprocess_config], config, pipeline, digest)
+
+            parsed = parser.parse_walmart_receipt(text)
+            is_valid, missing = parser.validate_parsed_data(parsed)
+            accepted = is_valid and confidence >= self.min_confidence
+            tried.append(tier)
+            metrics.observe(f'ocr.cascade.{tier}', time.perf_counter() - start)
+
+            attempt = {'text': text, 'parsed': parsed, 'tier': tier, 'confidence': confidence,
+                       'accepted': accepted, 'tiers_tried': tried,
+                       'partial': self.layout == 'totals'}
+            if accepted:
+                return attempt
+            if best is None or (len(missing), -confidence) < best[0]:
+                best = ((len(missing), -confidence), attempt)
+
+        if best is None:
+            raise ValueError("ReceiptOCR has no cascade tiers configured")
+        return best[1]
+
+    def _ocr_with_confidence(self, processed_image, config, pipeline, digest):
+        """
+        OCR a preprocessed image with word confidences, cached by image content
+        Returns: (text, mean word confidence)
+        """
+        key = None
+        if digest is not None:
+            key = self._cache_key(digest, '|'.join((pipeline.preprocess_config, config,
+                                                    self.backend.name, self.layout_config, 'data')))
+            cached = self.cache.get(key, 'text')
+            if cached is not None:
+                cached = json.loads(cached)
+                return cached['text'], cached['confidence']
+
+        with metrics.span('ocr.tesseract'):
+            text, confidences = self._recognize(processed_image, config, with_confidences=True)
+        confidence = float(np.mean(confidences)) if confidences else 0.0
+
+        if key is not None:
+            self.cache.put(key, 'text', json.dumps({'text': text, 'confidence': confidence}))
+        return text, confidence
+
+    def _ocr(self, processed_image):
+        """Run Tesseract on a preprocessed image"""
+        with metrics.span('ocr.tesseract'):
+            return self._recognize(processed_image, TESSERACT_CONFIG)[0]
+
+    @property
+    def layout_config(self):
+        """Layout settings, part of the OCR cache keys"""
+        return self.layout if self.layout == 'page' else f"{self.layout}:{self.tile_lines}"
+
+    def _recognize(self, processed_image, config, with_confidences=False):
+        """
+        OCR a preprocessed image using the instance's layout
+        Returns: (text, word confidences or None)
+        """
+        def read(image):
+            if with_confidences:
+                return self.backend.image_to_data(image, config)
+            return self.backend.image_to_string(image, config), None
+
+        if self.layout == 'page':
+            return read(processed_image)
+
+        with metrics.span('ocr.segment'):
+            lines = find_text_lines(processed_image)
+        height = processed_image.shape[0]
+        header = min(HEADER_LINES, len(lines)) if self.layout == 'totals' else 0
+
+        # Line ranges: the header first, then body tiles from the bottom up
+        ranges = [(0, header)] if header else []
+        for stop in range(len(lines), header, -self.tile_lines):
+            ranges.append((max(header, stop - self.tile_lines), stop))
+        if len(ranges) < 2:
+            return read(processed_image)
+
+        def read_tile(line_range):
+            top, bottom = tile_bounds(lines, *line_range, height)
+            # Tesseract wants some blank paper around the text
+            tile = cv2.copyMakeBorder(processed_image[top:bottom], 10, 10, 0, 0,
+                                      cv2.BORDER_CONSTANT, value=255)
+            return read(tile)
+
+        results = {}
+        if self.layout == 'tiles':
+            results = dict(zip(ranges, self._tile_pool.map(read_tile, ranges)))
+        else:
+            # Header plus a round of bottom tiles at a time, until the
+            # totals block has been reached
+            pending = ranges
+            while pending:
+                batch, pending = pending[:self.tile_workers], pending[self.tile_workers:]
+                results.update(zip(batch, self._tile_pool.map(read_tile, batch)))
+                if any(SUBTOTAL_RULE.search(results[line_range][0]) for line_range in batch
+                       if line_range[0] >= header):
+                    break
+
+        text = []
+        confidences = [] if with_confidences else None
+        for line_range in sorted(results):
+            tile_text, tile_confidences = results[line_range]
+            text.append(tile_text.strip())
+            if with_confidences:
+                confidences.extend(tile_confidences)
+        return '\n'.join(text), confidences
     
     def get_processed_image(self, image):
         """
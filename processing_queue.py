@@ -0,0 +1,208 @@
+"""
+Background OCR + parsing of receipt images
+
+The worker functions run in pool processes (used by both the Streamlit
+upload page and batch_ingest.py). ProcessingQueue wraps a process pool with
+per-job status so the UI can submit uploads and poll for results instead
+of blocking on OCR.
+"""
+
+import getpass
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# Per-process OCR/parser instances, created once by the pool initializer
+_ocr = None
+_parser = None
+
+# In-memory OCR cache of each caching worker. Kept small: there is one per
+# process, and a re-upload only finds it when it lands on the same worker.
+WORKER_CACHE_BYTES = 32 * 1024 * 1024
+
+# Disk cache tier shared by all caching workers (RECEIPT_OCR_CACHE_DIR overrides it)
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), f'receipt_ocr_cache-{getpass.getuser()}')
+
+
+def tile_workers_for(processes):
+    """Tile threads (and engines) per worker process, so a pool of processes shares the cores"""
+    return max(1, (os.cpu_count() or 1) // processes)
+
+
+def init_worker(use_cache=False, layout=None, tile_workers=1):
+    """
+    Create the OCR and parser objects once per worker process
+    use_cache: keep a WORKER_CACHE_BYTES memory cache in front of the shared
+               disk cache (RECEIPT_OCR_CACHE_DIR or DEFAULT_CACHE_DIR)
+    layout: ReceiptOCR layout (default: RECEIPT_OCR_LAYOUT or 'page')
+    tile_workers: tiles OCR'd at once by the tiled layouts (see tile_workers_for)
+    """
+    global _ocr, _parser
+    # Tesseract spawns its own OpenMP threads; with one process per core
+    # that only oversubscribes the CPU
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+    from ocr_backends import get_backend
+    from ocr_processor import ReceiptOCR
+    from receipt_parser import ReceiptParser
+
+    # Parallelism comes from the processes, so one warm engine each is enough
+    # (tiled layouts OCR tile_workers tiles at once and get that many engines).
+    # Batch runs see every image once, so they skip the cache entirely.
+    layout = layout or os.environ.get('RECEIPT_OCR_LAYOUT', 'page')
+    tile_workers = 1 if layout == 'page' else tile_workers
+    if use_cache:
+        cache_options = {'cache_bytes': WORKER_CACHE_BYTES,
+                         'cache_dir': os.environ.get('RECEIPT_OCR_CACHE_DIR') or DEFAULT_CACHE_DIR}
+    else:
+        cache_options = {'cache_bytes': 0}
+    backend = get_backend('auto', workers=tile_workers)
+    _ocr = ReceiptOCR(backend=backend, layout=layout, tile_workers=tile_workers, **cache_options)
+    _parser = ReceiptParser()
+
+
+def process_image(source, name=None):
+    """
+    OCR and parse one image (runs inside a worker process)
+    source: file path or the raw bytes of an uploaded image
+    Returns: dict with name, parsed data, OCR text, the OCR cascade tier
+             that produced it and its confidence, whether the text is
+             partial (line items skipped), and error (if any)
+    """
+    if name is None:
+        name = source if isinstance(source, str) else 'upload'
+
+    result = {'name': name, 'parsed': None, 'ocr_text': None, 'ocr_tier': None,
+              'ocr_confidence': None, 'ocr_partial': False, 'error': None}
+    try:
+        # Decoded straight to (possibly reduced) grayscale: no full-size RGB copy
+        ocr = _ocr.read_receipt(_ocr.load_image(source), _parser)
+        result['ocr_text'] = ocr['text']
+        result['parsed'] = ocr['parsed']
+        result['ocr_tier'] = ocr['tier']
+        result['ocr_confidence'] = round(ocr['confidence'], 1)
+        result['ocr_partial'] = ocr['partial']
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+class ProcessingQueue:
+    """
+    Process pool with job tracking, meant to be shared by all app sessions
+    Job status: 'queued' -> 'processing' -> 'done' or 'failed'
+    Uploaded bytes are only held by the pool until the job has run. Finished
+    jobs are forgotten after max_age seconds, and each owner keeps at most
+    max_finished of them, so sessions that go away don't pin their results.
+    """
+    def __init__(self, workers=None, max_age=3600, max_finished=50):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_age = max_age
+        self.max_finished = max_finished
+        # spawn: forking a threaded server process is not safe
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(True, None, tile_workers_for(self.workers)),
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, data, owner=None):
+        """
+        Queue an uploaded image for OCR (the queue keeps no copy of data;
+        callers that want to show the image again hold on to it themselves)
+        owner: identifies the submitting session so it only sees its own jobs
+        Returns: job ID
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'name': name,
+            'owner': owner,
+            'submitted_at': time.time(),
+            'finished_at': None,
+            'result': None,
+        }
+        with self._lock:
+            self._evict()
+            self._jobs[job_id] = job
+        job['future'] = future = self._pool.submit(process_image, data, name)
+        future.add_done_callback(lambda _: self._finish(job_id))
+        return job_id
+
+    def _evict(self):
+        """Drop finished jobs past max_age or beyond max_finished per owner (lock held)"""
+        now = time.time()
+        finished = {}
+        for job in sorted(self._jobs.values(), key=lambda job: job['finished_at'] or 0, reverse=True):
+            if job['finished_at'] is None:
+                continue
+            kept = finished.setdefault(job['owner'], [])
+            if now - job['finished_at'] > self.max_age or len(kept) >= self.max_finished:
+                del self._jobs[job['id']]
+            else:
+                kept.append(job['id'])
+
+    def _finish(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['finished_at'] = time.time()
+
+    @staticmethod
+    def _status(job):
+        future = job['future']
+        if not future.done():
+            return 'processing' if future.running() else 'queued'
+        if future.exception() is not None or future.result()['error']:
+            return 'failed'
+        return 'done'
+
+    def jobs(self, owner=None):
+        """Snapshot of jobs (optionally for one owner), oldest first"""
+        with self._lock:
+            self._evict()
+            jobs = [job for job in self._jobs.values()
+                    if 'future' in job and (owner is None or job['owner'] == owner)]
+
+        snapshot = []
+        for job in sorted(jobs, key=lambda job: job['submitted_at']):
+            status = self._status(job)
+            result = None
+            error = None
+            if status in ('done', 'failed'):
+                if job['future'].exception() is not None:
+                    error = f"{type(job['future'].exception()).__name__}: {job['future'].exception()}"
+                else:
+                    result = job['future'].result()
+                    error = result['error']
+            end = job['finished_at'] or time.time()
+            snapshot.append({
+                'id': job['id'],
+                'name': job['name'],
+                'status': status,
+                'result': result,
+                'error': error,
+                'elapsed': end - job['submitted_at'],
+            })
+        return snapshot
+
+    def pending(self, owner=None):
+        """Number of jobs not finished yet"""
+        return sum(1 for job in self.jobs(owner) if job['status'] in ('queued', 'processing'))
+
+    def remove(self, job_id):
+        """Forget a job (cancels it if it hasn't started)"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None and 'future' in job:
+            job['future'].cancel()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
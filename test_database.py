@@ -47,6 +47,105 @@ except Exception as e:
     import traceback
     traceback.print_exc()
 
+# Add test receipts in bulk
+print("\n5b. Adding test receipts in bulk...")
+try:
+    receipt_ids = db.add_receipts([
+        {'store_name': "Test Store", 'date': "02/08/2026", 'subtotal': 10.00,
+         'tax': 0.83, 'total': 10.83, 'transaction_id': "TESTBULK1"},
+        {'store_name': "Test Store", 'date': "02/09/2026", 'subtotal': 20.00,
+         'tax': 1.65, 'total': 21.65, 'transaction_id': "TESTBULK2"},
+    ])
+    print(f"   ✅ Receipt IDs: {receipt_ids}")
+except Exception as e:
+    print(f"   ❌ ERROR: {str(e)}")
+    import traceback
+    traceback.print_exc()
+
+# Add a test receipt with line items
+print("\n5c. Adding test receipt with line items...")
+try:
+    receipt_id = db.add_receipt(
+        store_name="Test Store",
+        date="02/10/2026",
+        subtotal=9.46,
+        tax=0.78,
+        total=10.24,
+        transaction_id="TESTITEMS",
+        items=[
+            {'description': "GV MILK 2%", 'item_code': "007874235186", 'quantity': 1, 'price': 3.48},
+            {'description': "COKE 12PK", 'item_code': "004900002890", 'quantity': 2, 'price': 5.98},
+        ]
+    )
+    print(f"   ✅ Receipt ID: {receipt_id}")
+    print(db.get_receipt_items(receipt_id))
+except Exception as e:
+    print(f"   ❌ ERROR: {str(e)}")
+    import traceback
+    traceback.print_exc()
+
+# Re-parse a receipt whose total was corrected by hand
+print("\n5d. Re-parsing a receipt with a hand-edited total...")
+try:
+    receipt_id = db.add_receipt(
+        store_name="Test Store",
+        date="02/11/2026",
+        subtotal=5.00,
+        tax=0.41,
+        total=5.41,
+        transaction_id="TESTEDIT",
+        parser_version=1,
+        edited_fields=['total']
+    )
+    updated = db.update_parsed_receipts(
+        [(receipt_id, {'store_name': "Test Store", 'date': "02/11/2026", 'subtotal': 5.00,
+                       'tax': 0.41, 'total': 54.10, 'transaction_id': "TESTEDIT2"})],
+        parser_version=2
+    )
+    row = db.find_receipts_by_transaction_id("TESTEDIT2")
+    row = row[row['id'] == receipt_id]
+    if updated == 1 and len(row) == 1 and row['total'].iloc[0] == 5.41:
+        print(f"   ✅ Edited total kept ({row['total'].iloc[0]}), other fields re-parsed")
+    else:
+        print(f"   ❌ ERROR: unexpected row after re-parse:\n{row}")
+except Exception as e:
+    print(f"   ❌ ERROR: {str(e)}")
+    import traceback
+    traceback.print_exc()
+
+# Check that OCR text is only stored compressed
+print("\n5e. Checking the on-disk size of stored OCR text...")
+try:
+    import tempfile
+    ocr_text = "WALMART SUPERCENTER\n" + "".join(
+        f"GROCERY ITEM {n:03d}   {n % 17 + 0.99:.2f} N\n" for n in range(40)
+    ) + "MARKER-ZQX42 TOTAL 123.45\n"
+    sizes = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, text in (('without text', None), ('with text', ocr_text)):
+            path = os.path.join(tmp, f"{len(sizes)}.db")
+            size_db = ReceiptDatabase(path)
+            size_db.add_receipts([{'store_name': "Test Store", 'date': "02/12/2026", 'total': 1.00,
+                                   'raw_ocr_text': text}] * 200)
+            size_db.vacuum()
+            size_db.close()
+            with open(path, 'rb') as f:
+                contents = f.read()
+            sizes[label] = len(contents)
+    growth = sizes['with text'] - sizes['without text']
+    raw = 200 * len(ocr_text.encode('utf-8'))
+    print(f"   OCR text: {raw} bytes, database growth: {growth} bytes")
+    if b"MARKER-ZQX42 TOTAL" in contents:
+        print("   ❌ ERROR: the database holds an uncompressed copy of the OCR text")
+    elif growth >= raw:
+        print("   ❌ ERROR: storing the OCR text takes more space than the text itself")
+    else:
+        print(f"   ✅ Stored and indexed in {growth / raw:.0%} of the text size")
+except Exception as e:
+    print(f"   ❌ ERROR: {str(e)}")
+    import traceback
+    traceback.print_exc()
+
 # Get all receipts
 print("\n6. Retrieving all receipts...")
 receipts = db.get_all_receipts()
@@ -60,6 +159,9 @@ if len(receipts) > 0:
     summary = db.get_spending_summary()
     print(summary)
     
+    print("\n8b. Monthly spending:")
+    print(db.get_spending_timeseries('month', rolling=3))
+    
     # Direct SQL query
     print("\n9. Direct SQL query:")
     conn = sqlite3.connect(db.db_name)